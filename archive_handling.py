@@ -0,0 +1,199 @@
+# archive_handling.py
+#
+# runs a roster operation on the saves inside a zip or tar archive without
+# extracting it. members are read one at a time, edited in memory and written
+# to a new archive straight away, so only one save is held at a time and
+# nothing touches the disk besides the two archives. tar input is read as a
+# stream, zip input needs its central directory but members are still read
+# one by one. members that are not saves, or that fail, are copied unchanged.
+
+from fnmatch import fnmatch
+from pathlib import Path
+import argparse
+import io
+import tarfile
+import time
+import zipfile
+import batch_processing
+import json_handling
+
+# archive suffix -> tarfile stream mode used to write it
+TAR_MODES = {
+    '.tar': 'w|',
+    '.tar.gz': 'w|gz',
+    '.tgz': 'w|gz',
+    '.tar.bz2': 'w|bz2',
+    '.tar.xz': 'w|xz'}
+
+class ArchiveFormatError(Exception):
+    pass
+
+class ArchiveMember:
+    def __init__(self, name: str, contents: bytes, info: object):
+        self.name = name
+        self.contents = contents
+        # the TarInfo or ZipInfo it came from, None for directories and
+        # other members without contents
+        self.info = info
+
+    def is_file(self) -> bool:
+        return self.contents != None
+
+def _iter_zip(path: str | Path) -> 'Generator':
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                yield ArchiveMember(info.filename, None, info)
+            else:
+                yield ArchiveMember(info.filename, archive.read(info), info)
+
+def _iter_tar(path: str | Path) -> 'Generator':
+    try:
+        archive = tarfile.open(path, 'r|*')
+    except tarfile.TarError:
+        raise ArchiveFormatError(f'{path} is not a zip or tar archive')
+
+    with archive:
+        for info in archive:
+            if info.isfile():
+                yield ArchiveMember(info.name, archive.extractfile(info).read(), info)
+            else:
+                yield ArchiveMember(info.name, None, info)
+
+def iter_archive(path: str | Path) -> 'Generator':
+    if zipfile.is_zipfile(path):
+        return _iter_zip(path)
+    return _iter_tar(path)
+
+def _tar_mode(path: str | Path) -> str:
+    name = Path(path).name.lower()
+    for suffix, mode in TAR_MODES.items():
+        if name.endswith(suffix):
+            return mode
+    return None
+
+class ArchiveWriter:
+    def __init__(self, path: str | Path):
+        self._zip = None
+        self._tar = None
+        if Path(path).suffix.lower() == '.zip':
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            mode = _tar_mode(path)
+            if mode == None:
+                raise ArchiveFormatError(f'Cannot tell the archive type of {path}, use .zip, '
+                                         + ', '.join(TAR_MODES))
+            self._tar = tarfile.open(path, mode)
+
+    def add(self, member: ArchiveMember, contents: bytes = None) -> None:
+        # writes the member with new contents if given, keeping its name,
+        # times and permissions
+        if contents == None:
+            contents = member.contents
+
+        if self._zip != None:
+            self._write_zip(member, contents)
+        else:
+            self._write_tar(member, contents)
+
+    def _write_zip(self, member: ArchiveMember, contents: bytes) -> None:
+        if isinstance(member.info, zipfile.ZipInfo):
+            info = zipfile.ZipInfo(member.info.filename, member.info.date_time)
+            info.external_attr = member.info.external_attr
+        else:
+            info = zipfile.ZipInfo(member.name, time.localtime(member.info.mtime)[:6])
+            info.external_attr = (member.info.mode & 0xFFFF) << 16
+            if not member.is_file():
+                info.filename = member.name.rstrip('/') + '/'
+
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._zip.writestr(info, contents or b'')
+
+    def _write_tar(self, member: ArchiveMember, contents: bytes) -> None:
+        if isinstance(member.info, tarfile.TarInfo):
+            info = member.info
+        else:
+            info = tarfile.TarInfo(member.name.rstrip('/'))
+            info.mtime = time.mktime(member.info.date_time + (0, 0, -1))
+            info.mode = (member.info.external_attr >> 16) or 0o644
+            if not member.is_file():
+                info.type = tarfile.DIRTYPE
+
+        if contents == None:
+            self._tar.addfile(info)
+        else:
+            info.size = len(contents)
+            self._tar.addfile(info, io.BytesIO(contents))
+
+    def close(self) -> None:
+        if self._zip != None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.close()
+        return False
+
+def _process_member(member: ArchiveMember, operation: str,
+                    reference_data: json_handling.ReferenceData) -> tuple[dict, bytes]:
+    start = time.perf_counter()
+    result = {'path': member.name, 'ok': False, 'result': None, 'error': None}
+    contents = None
+
+    try:
+        save_file = json_handling.DragaliaSaveFile.from_bytes(member.name, member.contents, reference_data)
+        result['result'] = batch_processing.OPERATIONS[operation](save_file)
+        contents = save_file.to_bytes()
+        result['ok'] = True
+    except Exception as error:
+        result['error'] = batch_processing._describe_error(error)
+
+    result['seconds'] = time.perf_counter() - start
+    return result, contents
+
+def process_archive(source: str | Path, destination: str | Path, operation: str,
+                    pattern: str = batch_processing.DEFAULT_PATTERN,
+                    reference_data: json_handling.ReferenceData = None) -> batch_processing.BatchReport:
+    # members whose name matches pattern are edited, everything else is
+    # copied across as it is
+    if operation not in batch_processing.OPERATIONS:
+        raise ValueError(f'Unknown operation: {operation}')
+    if Path(source).resolve() == Path(destination).resolve():
+        raise ArchiveFormatError('The output archive must not replace the input archive')
+    if reference_data == None:
+        reference_data = json_handling.ReferenceData()
+
+    report = batch_processing.BatchReport(operation)
+    start = time.perf_counter()
+
+    with ArchiveWriter(destination) as writer:
+        for member in iter_archive(source):
+            if not member.is_file() or not fnmatch(Path(member.name).name, pattern):
+                writer.add(member)
+                continue
+
+            result, contents = _process_member(member, operation, reference_data)
+            report.add(result)
+            writer.add(member, contents)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run a roster operation on every save inside an archive.')
+    parser.add_argument('source', help = 'zip or tar archive, tar may be gzip, bzip2 or xz compressed')
+    parser.add_argument('destination', help = 'archive to write, its type is taken from the suffix')
+    parser.add_argument('operation', choices = sorted(batch_processing.OPERATIONS))
+    parser.add_argument('--pattern', default = batch_processing.DEFAULT_PATTERN,
+                        help = 'file names inside the archive to treat as saves')
+    args = parser.parse_args()
+
+    try:
+        report = process_archive(args.source, args.destination, args.operation, args.pattern)
+        report.print_summary()
+    except (ArchiveFormatError, zipfile.BadZipFile, tarfile.TarError) as error:
+        print(error)
@@ -0,0 +1,137 @@
+# async_handling.py
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import weakref
+import json_handling
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_PENDING = 256
+
+class SaveExecutor:
+    # runs blocking save work (reads, parses, edits, writes) on a fixed pool
+    # of threads. the semaphore caps how many jobs can be queued at once so
+    # that opening thousands of saves cannot pile up unbounded work. an
+    # asyncio semaphore belongs to one event loop, so each loop that uses the
+    # executor gets its own
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS,
+                 max_pending: int = DEFAULT_MAX_PENDING):
+        self._pool = ThreadPoolExecutor(max_workers = max_workers,
+                                        thread_name_prefix = 'save-io')
+        self._max_pending = max_pending
+        self._slots = weakref.WeakKeyDictionary()
+        self._slots_lock = threading.Lock()
+
+    def _get_slots(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        with self._slots_lock:
+            if loop not in self._slots:
+                self._slots[loop] = asyncio.Semaphore(self._max_pending)
+            return self._slots[loop]
+
+    async def run(self, func: 'Function', *args, **kwargs) -> object:
+        loop = asyncio.get_running_loop()
+        async with self._get_slots(loop):
+            return await loop.run_in_executor(self._pool, lambda: func(*args, **kwargs))
+
+    def submit(self, func: 'Function', *args, **kwargs) -> Future:
+        # not tied to any event loop, for work shared between loops
+        return self._pool.submit(func, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait = True)
+
+_default_executor = None
+# the one shared load of the reference data, every opener awaits the same one
+_reference_future = None
+_reference_lock = threading.Lock()
+
+def get_default_executor() -> SaveExecutor:
+    global _default_executor
+    if _default_executor == None:
+        _default_executor = SaveExecutor()
+    return _default_executor
+
+async def _get_reference_data(executor: SaveExecutor) -> json_handling.ReferenceData:
+    global _reference_future
+    with _reference_lock:
+        if _reference_future == None:
+            _reference_future = executor.submit(json_handling.ReferenceData)
+        future = _reference_future
+
+    try:
+        return await asyncio.wrap_future(future)
+    except Exception:
+        # let the next opener try again instead of caching the failure
+        with _reference_lock:
+            if _reference_future is future:
+                _reference_future = None
+        raise
+
+class AsyncSaveFile:
+    # asyncio wrapper around DragaliaSaveFile. edits are kept in memory and
+    # only written to disk when flush() is awaited
+    def __init__(self, save_file: json_handling.DragaliaSaveFile,
+                 executor: SaveExecutor):
+        self._save_file = save_file
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, file_path: 'File path',
+                   reference_data: json_handling.ReferenceData = None,
+                   executor: SaveExecutor = None) -> 'AsyncSaveFile':
+        if executor == None:
+            executor = get_default_executor()
+        if reference_data == None:
+            reference_data = await _get_reference_data(executor)
+
+        save_file = await executor.run(json_handling.DragaliaSaveFile, file_path,
+                                       reference_data, auto_update = False)
+        return cls(save_file, executor)
+
+    @property
+    def save_file(self) -> json_handling.DragaliaSaveFile:
+        return self._save_file
+
+    def get_user_data(self) -> dict:
+        return self._save_file.get_user_data()
+
+    def get_character_data(self) -> list:
+        return self._save_file.get_character_data()
+
+    def has_unsaved_changes(self) -> bool:
+        return self._save_file.has_unsaved_changes()
+
+    async def _run(self, func: 'Function', *args, **kwargs) -> object:
+        # one operation at a time per save, edits on different saves can
+        # still run side by side on the executor
+        async with self._lock:
+            return await self._executor.run(func, *args, **kwargs)
+
+    async def modify_user_data(self, field: str, new_value: int | str) -> None:
+        await self._run(self._save_file.modify_user_data, field, new_value)
+
+    async def add_char(self, char_id: int, **kwargs) -> bool:
+        return await self._run(self._save_file.add_char, char_id, **kwargs)
+
+    async def add_all_missing_chars(self) -> int:
+        return await self._run(self._save_file.add_all_missing_chars)
+
+    async def max_all_current_chars(self) -> None:
+        await self._run(self._save_file.max_all_current_chars)
+
+    async def max_out_character_list(self) -> None:
+        await self._run(self._save_file.max_out_character_list)
+
+    async def flush(self) -> None:
+        await self._run(self._save_file.flush)
+
+async def open_all(file_paths: list['File path'],
+                   reference_data: json_handling.ReferenceData = None,
+                   executor: SaveExecutor = None) -> list[AsyncSaveFile]:
+    return await asyncio.gather(*[AsyncSaveFile.open(path, reference_data, executor)
+                                  for path in file_paths])
+
+async def flush_all(save_files: list[AsyncSaveFile]) -> None:
+    await asyncio.gather(*[save_file.flush() for save_file in save_files])
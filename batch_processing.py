@@ -0,0 +1,184 @@
+# batch_processing.py
+
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import instrumentation
+import json_handling
+import save_validation
+
+DEFAULT_PATTERN = '*.txt'
+DEFAULT_MAX_WRITERS = 4
+
+def _add_all_missing_chars(save_file: json_handling.DragaliaSaveFile) -> int:
+    return save_file.add_all_missing_chars()
+
+def _max_all_current_chars(save_file: json_handling.DragaliaSaveFile) -> None:
+    save_file.max_all_current_chars()
+
+def _max_out_character_list(save_file: json_handling.DragaliaSaveFile) -> None:
+    save_file.max_out_character_list()
+
+def _mark_all_stories_read(save_file: json_handling.DragaliaSaveFile) -> int:
+    return save_file.mark_all_stories_read()
+
+def _remove_orphaned_stories(save_file: json_handling.DragaliaSaveFile) -> int:
+    return save_file.remove_orphaned_stories()
+
+OPERATIONS = {
+    'add_all_missing_chars': _add_all_missing_chars,
+    'max_all_current_chars': _max_all_current_chars,
+    'max_out_character_list': _max_out_character_list,
+    'mark_all_stories_read': _mark_all_stories_read,
+    'remove_orphaned_stories': _remove_orphaned_stories}
+
+# set once per worker by _initialize_worker. with the fork start method these
+# are inherited from the parent instead of being pickled for every task
+_reference_data = None
+_write_slots = None
+_operation = None
+_prevalidate = False
+
+def _initialize_worker(reference_data: json_handling.ReferenceData,
+                       write_slots: 'Semaphore', operation: str,
+                       prevalidate: bool) -> None:
+    global _reference_data, _write_slots, _operation, _prevalidate
+    _reference_data = reference_data
+    _write_slots = write_slots
+    _operation = operation
+    _prevalidate = prevalidate
+
+def _describe_error(error: Exception) -> str:
+    if str(error) == '':
+        return type(error).__name__
+    return f'{type(error).__name__}: {error}'
+
+def _process_save(path: str) -> dict:
+    start = time.perf_counter()
+    result = {'path': path, 'ok': False, 'result': None, 'error': None}
+
+    try:
+        if _prevalidate:
+            problems = save_validation.validate_save(path)
+            if len(problems) != 0:
+                raise save_validation.NotASaveFileError('; '.join(str(problem) for problem in problems))
+
+        save_file = json_handling.DragaliaSaveFile(path, _reference_data, auto_update = False)
+
+        with save_file.lock():
+            if save_file.is_stale():
+                save_file.reload()
+
+            result['result'] = OPERATIONS[_operation](save_file)
+
+            # the edit itself is cpu bound, only the write is throttled so a
+            # many-core host does not flood a slow disk
+            with _write_slots:
+                save_file.flush()
+
+        result['ok'] = True
+    except Exception as error:
+        result['error'] = _describe_error(error)
+
+    result['seconds'] = time.perf_counter() - start
+
+    # pool workers exit without running atexit handlers, so write out the
+    # metrics gathered so far after every save
+    if instrumentation.is_enabled():
+        instrumentation.flush()
+
+    return result
+
+class BatchReport:
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.results = []
+        self.elapsed = 0.0
+
+    def add(self, result: dict) -> None:
+        self.results.append(result)
+
+    def succeeded(self) -> list[dict]:
+        return [result for result in self.results if result['ok']]
+
+    def failed(self) -> list[dict]:
+        return [result for result in self.results if not result['ok']]
+
+    def to_dict(self) -> dict:
+        return {
+            'operation': self.operation,
+            'total': len(self.results),
+            'succeeded': len(self.succeeded()),
+            'failed': len(self.failed()),
+            'elapsed_seconds': self.elapsed,
+            'results': sorted(self.results, key = lambda result: result['path'])}
+
+    def print_summary(self) -> None:
+        print(f'{self.operation}: {len(self.succeeded())} of {len(self.results)} \
+saves processed in {self.elapsed:.2f}s.')
+
+        for result in sorted(self.failed(), key = lambda result: result['path']):
+            print(f"  FAILED {result['path']}: {result['error']}")
+
+def find_saves(directory: str | Path, pattern: str = DEFAULT_PATTERN) -> list[str]:
+    return sorted(str(path) for path in Path(directory).glob(pattern) if path.is_file())
+
+def _get_context() -> 'Context':
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('spawn')
+
+def run_batch(paths: list[str], operation: str, workers: int = None,
+              max_writers: int = DEFAULT_MAX_WRITERS,
+              reference_data: json_handling.ReferenceData = None,
+              prevalidate: bool = False) -> BatchReport:
+    if operation not in OPERATIONS:
+        raise ValueError(f'Unknown operation: {operation}')
+    if reference_data == None:
+        reference_data = json_handling.ReferenceData()
+    if workers == None:
+        workers = os.cpu_count() or 1
+
+    report = BatchReport(operation)
+    start = time.perf_counter()
+    context = _get_context()
+    write_slots = context.Semaphore(max(1, max_writers))
+    workers = max(1, min(workers, len(paths)))
+
+    # chunksize 1 keeps every save on the shared task queue, so a worker that
+    # finishes a small save immediately takes the next one instead of waiting
+    # behind a pre-assigned slice
+    with context.Pool(workers, _initialize_worker,
+                      (reference_data, write_slots, operation, prevalidate)) as pool:
+        for result in pool.imap_unordered(_process_save, paths, chunksize = 1):
+            report.add(result)
+
+    report.elapsed = time.perf_counter() - start
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run a roster operation on every save in a directory.')
+    parser.add_argument('directory')
+    parser.add_argument('operation', choices = sorted(OPERATIONS))
+    parser.add_argument('--pattern', default = DEFAULT_PATTERN)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--max-writers', type = int, default = DEFAULT_MAX_WRITERS)
+    parser.add_argument('--report', help = 'write the full per-save report to this JSON file')
+    parser.add_argument('--prevalidate', action = 'store_true',
+                        help = 'scan each file for the save layout first, faster when the directory holds other files')
+    args = parser.parse_args()
+
+    paths = find_saves(args.directory, args.pattern)
+    if len(paths) == 0:
+        print(f'No saves matching {args.pattern} found in {args.directory}.')
+    else:
+        report = run_batch(paths, args.operation, args.workers, args.max_writers,
+                           prevalidate = args.prevalidate)
+        report.print_summary()
+
+        if args.report != None:
+            with open(args.report, 'w') as file:
+                json.dump(report.to_dict(), file, indent = 2)
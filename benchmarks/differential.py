@@ -0,0 +1,380 @@
+# benchmarks/differential.py
+#
+# checks that every way of editing a save produces exactly the same file as
+# the frozen reference engine, a copy of the editor's original linear-scan
+# edit code kept in benchmarks/reference_engine.py. random saves and edit
+# sequences (characters, user data and unit stories) are
+# generated from the data/ catalog, run through the reference engine and
+# every other engine, and the resulting bytes are compared. a failing case is
+# shrunk to the fewest edits and the smallest save that still fails.
+#
+# run from the repository root with: python -m benchmarks.differential
+#
+# a faster implementation is checked by adding a function to ENGINES that
+# takes the save's bytes, the edits and the reference data and returns the
+# edited save's bytes.
+
+from pathlib import Path
+from unittest import mock
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+import json_handling
+from benchmarks import reference_engine
+from benchmarks import save_generator
+
+# new characters get the current time as gettime, every engine sees this one
+FROZEN_TIME = 1700000000
+DEFAULT_CASES = 50
+DEFAULT_MAX_EDITS = 6
+USER_DATA_FIELDS = ('crystal', 'coin', 'mana_point', 'dew_point', 'level', 'name')
+EDITS = ('add_char', 'add_all_missing_chars', 'max_all_current_chars', 'max_out_character_list',
+         'modify_user_data', 'mark_all_stories_read', 'mark_stories_read',
+         'remove_orphaned_stories')
+
+def apply_edit(save_file: json_handling.DragaliaSaveFile, edit: list) -> None:
+    name, args = edit[0], edit[1:]
+    if name == 'add_char':
+        save_file.add_char(*args)
+    elif name == 'add_all_missing_chars':
+        save_file.add_all_missing_chars()
+    elif name == 'max_all_current_chars':
+        save_file.max_all_current_chars()
+    elif name == 'max_out_character_list':
+        save_file.max_out_character_list()
+    elif name == 'modify_user_data':
+        save_file.modify_user_data(*args)
+    elif name == 'mark_all_stories_read':
+        save_file.mark_all_stories_read()
+    elif name == 'mark_stories_read':
+        save_file.mark_stories_read(*args)
+    elif name == 'remove_orphaned_stories':
+        save_file.remove_orphaned_stories()
+    else:
+        raise ValueError(f'Unknown edit: {name}')
+
+def _apply_reference_edit(save: reference_engine.ReferenceSave, edit: list) -> None:
+    # the reference names its methods after the edits
+    name, args = edit[0], edit[1:]
+    if name not in EDITS:
+        raise ValueError(f'Unknown edit: {name}')
+    getattr(save, name)(*args)
+
+def _reference_engine(contents: bytes, edits: list,
+                      reference_data: json_handling.ReferenceData) -> bytes:
+    # the frozen original code, working on the parsed document directly
+    save = reference_engine.ReferenceSave(json.loads(contents), reference_data.all_character_data,
+                                          reference_data.story_data)
+    for edit in edits:
+        _apply_reference_edit(save, edit)
+    return save.to_bytes()
+
+def _current_engine(contents: bytes, edits: list,
+                    reference_data: json_handling.ReferenceData) -> bytes:
+    # the editor as it is used: a file on disk written after every edit
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'save.txt')
+        with open(path, 'wb') as file:
+            file.write(contents)
+
+        save_file = json_handling.DragaliaSaveFile(path, reference_data)
+        for edit in edits:
+            apply_edit(save_file, edit)
+
+        with open(path, 'rb') as file:
+            return file.read()
+
+def _deferred_engine(contents: bytes, edits: list,
+                     reference_data: json_handling.ReferenceData) -> bytes:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'save.txt')
+        with open(path, 'wb') as file:
+            file.write(contents)
+
+        save_file = json_handling.DragaliaSaveFile(path, reference_data, auto_update = False)
+        for edit in edits:
+            apply_edit(save_file, edit)
+        save_file.flush()
+
+        with open(path, 'rb') as file:
+            return file.read()
+
+def _in_memory_engine(contents: bytes, edits: list,
+                      reference_data: json_handling.ReferenceData) -> bytes:
+    save_file = json_handling.DragaliaSaveFile.from_bytes('save.txt', contents, reference_data)
+    for edit in edits:
+        apply_edit(save_file, edit)
+    return save_file.to_bytes()
+
+def _undo_redo_engine(contents: bytes, edits: list,
+                      reference_data: json_handling.ReferenceData) -> bytes:
+    # every edit is undone and redone straight away, then the whole history
+    # is undone and redone once more
+    save_file = json_handling.DragaliaSaveFile.from_bytes('save.txt', contents, reference_data)
+    for edit in edits:
+        apply_edit(save_file, edit)
+        save_file.undo()
+        save_file.redo()
+
+    while save_file.undo():
+        pass
+    while save_file.redo():
+        pass
+    return save_file.to_bytes()
+
+def _pad_history(save_file: json_handling.DragaliaSaveFile) -> None:
+    # fills the undo history past its limit with edits that change nothing
+    coin = save_file.get_user_data()['coin']
+    for _ in range(json_handling.HISTORY_LIMIT + 5):
+        save_file.modify_user_data('coin', coin)
+
+def _rollback_engine(contents: bytes, edits: list,
+                     reference_data: json_handling.ReferenceData) -> bytes:
+    # runs with the undo history past its limit: the edits are rolled back
+    # and made again, then a second copy of them is rolled back
+    save_file = json_handling.DragaliaSaveFile.from_bytes('save.txt', contents, reference_data)
+    trimmed = save_file.checkpoint()
+    _pad_history(save_file)
+    try:
+        save_file.rollback(trimmed)
+        raise AssertionError('rolled back to a checkpoint that was trimmed away')
+    except json_handling.CheckpointTrimmedError:
+        pass
+
+    before = save_file.to_bytes()
+    checkpoint = save_file.checkpoint()
+    for edit in edits:
+        apply_edit(save_file, edit)
+    save_file.rollback(checkpoint)
+    if save_file.to_bytes() != before:
+        raise AssertionError('rollback did not restore the save')
+
+    for edit in edits:
+        apply_edit(save_file, edit)
+    checkpoint = save_file.checkpoint()
+    for edit in edits:
+        apply_edit(save_file, edit)
+    save_file.rollback(checkpoint)
+    return save_file.to_bytes()
+
+def _gzip_engine(contents: bytes, edits: list,
+                 reference_data: json_handling.ReferenceData) -> bytes:
+    save_file = json_handling.DragaliaSaveFile.from_bytes('save.txt.gz', gzip.compress(contents),
+                                                          reference_data)
+    for edit in edits:
+        apply_edit(save_file, edit)
+    return gzip.decompress(save_file.to_bytes())
+
+REFERENCE_ENGINE = 'reference'
+
+ENGINES = {
+    REFERENCE_ENGINE: _reference_engine,
+    'current': _current_engine,
+    'deferred': _deferred_engine,
+    'in_memory': _in_memory_engine,
+    'undo_redo': _undo_redo_engine,
+    'rollback': _rollback_engine,
+    'gzip': _gzip_engine}
+
+def _random_edit(rng: random.Random, char_ids: list[int]) -> list:
+    # undo and redo are left out, they are covered by the undo_redo engine
+    choice = rng.random()
+    if choice < 0.4:
+        return ['add_char', rng.choice(char_ids)]
+    if choice < 0.47:
+        return ['add_all_missing_chars']
+    if choice < 0.54:
+        return ['max_all_current_chars']
+    if choice < 0.58:
+        return ['max_out_character_list']
+    if choice < 0.7:
+        return ['mark_all_stories_read']
+    if choice < 0.78:
+        return ['mark_stories_read', rng.sample(char_ids, rng.randint(1, 5))]
+    if choice < 0.85:
+        return ['remove_orphaned_stories']
+
+    field = rng.choice(USER_DATA_FIELDS)
+    if field == 'name':
+        return ['modify_user_data', field, f'Player{rng.randint(0, 9999)}']
+    return ['modify_user_data', field, rng.randint(0, 2147483647)]
+
+def generate_case(rng: random.Random, reference_data: json_handling.ReferenceData,
+                  max_edits: int = DEFAULT_MAX_EDITS) -> dict:
+    char_ids = sorted(int(char_id) for char_id in reference_data.all_character_data
+                      if char_id != '19900004')
+    return {
+        'profile': rng.choice(save_generator.PROFILES),
+        'seed': rng.randint(0, 2 ** 31),
+        'roster_fraction': round(rng.random(), 2),
+        # stories of characters the save does not own and stories that are
+        # in no catalog, both seeded into the save
+        'orphan_stories': rng.randint(0, 3),
+        'extra_stories': rng.randint(0, 3),
+        'edits': [_random_edit(rng, char_ids) for _ in range(rng.randint(1, max_edits))]}
+
+def _seed_save(document: dict, case: dict, reference_data: json_handling.ReferenceData) -> None:
+    rng = random.Random(case['seed'])
+    owned = set(str(char['chara_id']) for char in document['data']['chara_list'])
+    unowned = sorted(char_id for char_id in reference_data.story_data if char_id not in owned)
+    for char_id in rng.sample(unowned, min(case['orphan_stories'], len(unowned))):
+        for story in reference_data.story_data[char_id]:
+            document['data']['unit_story_list'].append({'unit_story_id': int(story),
+                                                        'is_read': rng.randint(0, 1)})
+
+def _bonus_totals(document: dict) -> dict:
+    bonuses = document['data']['fort_bonus_list']
+    return {key: [(bonus['hp'], bonus['attack']) for bonus in bonuses[key]]
+            for key in ('chara_bonus_by_album', 'dragon_bonus_by_album')}
+
+def _first_difference(expected: object, actual: object, path: str = '') -> str:
+    if type(expected) != type(actual):
+        return f'{path or "/"}: {expected!r} != {actual!r}'
+    if isinstance(expected, dict):
+        for key in sorted(set(expected) | set(actual), key = str):
+            if key not in expected or key not in actual:
+                return f'{path}/{key}: only in {"actual" if key in actual else "expected"}'
+            difference = _first_difference(expected[key], actual[key], f'{path}/{key}')
+            if difference != None:
+                return difference
+        return None
+    if isinstance(expected, list):
+        for i, (left, right) in enumerate(zip(expected, actual)):
+            difference = _first_difference(left, right, f'{path}/{i}')
+            if difference != None:
+                return difference
+        if len(expected) != len(actual):
+            return f'{path}: length {len(expected)} != {len(actual)}'
+        return None
+    if expected != actual:
+        return f'{path or "/"}: {expected!r} != {actual!r}'
+    return None
+
+def _run(engine: str, case: dict, reference_data: json_handling.ReferenceData) -> bytes:
+    document = save_generator.generate_save(case['profile'], case['seed'], reference_data,
+                                            case['roster_fraction'], case['extra_stories'])
+    _seed_save(document, case, reference_data)
+    contents = json.dumps(document, indent = 2).replace('\n', os.linesep).encode()
+    with mock.patch('time.time', return_value = FROZEN_TIME):
+        return ENGINES[engine](contents, case['edits'], reference_data)
+
+def check_case(case: dict, engine: str, reference_data: json_handling.ReferenceData) -> str:
+    # returns None if the engine matches the reference, otherwise what differs
+    try:
+        expected = _run(REFERENCE_ENGINE, case, reference_data)
+    except Exception as error:
+        return f'reference engine raised {type(error).__name__}: {error}'
+    try:
+        actual = _run(engine, case, reference_data)
+    except Exception as error:
+        return f'raised {type(error).__name__}: {error}'
+
+    if actual == expected:
+        return None
+
+    try:
+        expected_document = json.loads(expected)
+        actual_document = json.loads(actual)
+    except ValueError:
+        return 'output is not valid JSON'
+
+    if _bonus_totals(expected_document) != _bonus_totals(actual_document):
+        return 'encyclopedia bonus totals differ: ' + \
+            _first_difference(_bonus_totals(expected_document), _bonus_totals(actual_document))
+    difference = _first_difference(expected_document, actual_document)
+    if difference == None:
+        return 'documents are equal but the bytes differ (formatting or key order)'
+    return difference
+
+def _shrink_edits(case: dict, fails: 'Function') -> dict:
+    # delta debugging: drop ever smaller chunks of edits while it still fails
+    edits = case['edits']
+    chunk = max(1, len(edits) // 2)
+    while True:
+        removed = False
+        start = 0
+        while start < len(edits):
+            candidate = edits[:start] + edits[start + chunk:]
+            if len(candidate) != 0 and fails(dict(case, edits = candidate)):
+                edits = candidate
+                removed = True
+            else:
+                start += chunk
+        if chunk == 1 and not removed:
+            break
+        chunk = max(1, chunk // 2) if not removed else chunk
+    return dict(case, edits = edits)
+
+def shrink(case: dict, engine: str, reference_data: json_handling.ReferenceData) -> dict:
+    fails = lambda candidate: check_case(candidate, engine, reference_data) != None
+    case = _shrink_edits(case, fails)
+
+    # then the smallest starting save that still fails
+    for profile in save_generator.PROFILES:
+        if profile == case['profile']:
+            break
+        if fails(dict(case, profile = profile)):
+            case = dict(case, profile = profile)
+            break
+
+    if case['profile'] == 'partial':
+        for fraction in (0.0, 0.01, 0.05, 0.1, 0.25):
+            if fraction < case['roster_fraction'] and fails(dict(case, roster_fraction = fraction)):
+                case = dict(case, roster_fraction = fraction)
+                break
+
+    for key in ('orphan_stories', 'extra_stories'):
+        for count in range(case[key]):
+            if fails(dict(case, **{key: count})):
+                case = dict(case, **{key: count})
+                break
+
+    return _shrink_edits(case, fails)
+
+def run_harness(cases: int = DEFAULT_CASES, seed: int = 0, engines: list[str] = None,
+                max_edits: int = DEFAULT_MAX_EDITS,
+                reference_data: json_handling.ReferenceData = None) -> list[dict]:
+    if reference_data == None:
+        reference_data = json_handling.ReferenceData()
+    if engines == None:
+        engines = [engine for engine in ENGINES if engine != REFERENCE_ENGINE]
+
+    rng = random.Random(seed)
+    failures = []
+    for number in range(cases):
+        case = generate_case(rng, reference_data, max_edits)
+        for engine in engines:
+            if check_case(case, engine, reference_data) == None:
+                continue
+            minimal = shrink(case, engine, reference_data)
+            failures.append({'case_number': number, 'engine': engine, 'case': minimal,
+                             'difference': check_case(minimal, engine, reference_data)})
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check that every save engine matches the frozen reference editor.')
+    parser.add_argument('--cases', type = int, default = DEFAULT_CASES)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--engine', action = 'append', choices = sorted(ENGINES))
+    parser.add_argument('--max-edits', type = int, default = DEFAULT_MAX_EDITS)
+    args = parser.parse_args()
+
+    failures = run_harness(args.cases, args.seed, args.engine, args.max_edits)
+    engines = args.engine or [engine for engine in ENGINES if engine != REFERENCE_ENGINE]
+    print(f'{args.cases} cases against {", ".join(engines)}: {len(failures)} failed.')
+
+    for failure in failures:
+        print(f"FAILED case {failure['case_number']} on {failure['engine']}: {failure['difference']}")
+        print('  minimal case: ' + json.dumps(failure['case']))
+    if len(failures) != 0:
+        sys.exit(1)
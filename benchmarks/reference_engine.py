@@ -0,0 +1,238 @@
+# benchmarks/reference_engine.py
+#
+# a frozen copy of the editor's original, plain edit code, used by
+# benchmarks.differential as the behaviour every faster engine must match.
+# the character code is the linear-scan add_char / _add_stories / bonus code
+# from before any optimisation (with the fsum argument fix). the unit story
+# operations, which never had a slow version, are written here as the
+# simplest scan over the list that does what their docs describe.
+#
+# do not optimise or share code with json_handling: this file is only useful
+# while it stays independent of the code it checks.
+
+import json
+import math
+import os
+import time
+
+class ReferenceSave:
+    def __init__(self, document: dict, all_character_data: dict, story_data: dict):
+        self._data = document
+        self._user_data = document['data']['user_data']
+        self._character_data = document['data']['chara_list']
+        self._adv_encyclo = document['data']['fort_bonus_list']['chara_bonus_by_album']
+        self._dragon_encyclo = document['data']['fort_bonus_list']['dragon_bonus_by_album']
+        self._stories = document['data']['unit_story_list']
+        self.all_character_data = all_character_data
+        self.story_data = story_data
+
+    def to_bytes(self) -> bytes:
+        return json.dumps(self._data, indent = 2).replace('\n', os.linesep).encode()
+
+    def modify_user_data(self, field: str, new_value: int | str) -> None:
+        self._user_data[field] = new_value
+
+    def add_char(self, char_id: int, has_spiral: bool = False,
+                 shared_skill_cost: int = 0, max_hp: int = 0, max_atk: int = 0,
+                 stories: list[int] = None, gettime: int = None,
+                 group: bool = False) -> bool:
+        char_exists = False
+        index = -1
+        for i in range(len(self._character_data)):
+            if char_id == self._character_data[i]['chara_id']:
+                char_exists = True
+                index = i
+                break
+
+        if char_exists:
+            gettime = self._character_data[index]['gettime']
+            og_level = self._character_data[index]['level']
+            og_mc = len(self._character_data[index]['mana_circle_piece_id_list'])
+
+            self._character_data[index] = self._create_max_character(char_id, gettime = gettime)
+
+            element = int(str(char_id)[5])
+            has_spiral = self._character_data[i]['level'] == 100
+
+            if self._character_data[i]['level'] != og_level:
+                    if og_level < 80:
+                        if has_spiral:
+                            self._add_adv_encyclo_bonus(element, hp = 0.2)
+                        else:
+                            self._add_adv_encyclo_bonus(element, hp = 0.1)
+                    else:
+                        self._add_adv_encyclo_bonus(element, hp = 0.1)
+
+            if len(self._character_data[i]['mana_circle_piece_id_list']) != og_mc:
+                    if og_mc < 50:
+                        if has_spiral:
+                            self._add_adv_encyclo_bonus(element, atk = 0.2)
+                        else:
+                            self._add_adv_encyclo_bonus(element, atk = 0.1)
+                    else:
+                        self._add_adv_encyclo_bonus(element, atk = 0.1)
+            
+            output = False
+        else:
+            self._character_data.append(self._create_max_character(char_id, has_spiral, shared_skill_cost, max_hp, max_atk, stories, gettime))
+            element = int(str(char_id)[5])
+            has_spiral = self._character_data[-1]['level'] == 100
+
+            if has_spiral:
+                self._add_adv_encyclo_bonus(element, 0.3, 0.3)
+            else:
+                self._add_adv_encyclo_bonus(element, 0.2, 0.2)
+
+            output = True
+
+        return output
+
+    def add_all_missing_chars(self) -> int:
+        current_chars = set()
+        count = 0
+        
+        for existing_char in self._character_data:
+            current_chars.add(existing_char['chara_id'])
+
+        for char_id in self.all_character_data:
+            if int(char_id) not in current_chars and char_id != "19900004":
+                self.add_char(int(char_id), group = True)
+                count += 1
+
+        return count
+
+    def max_all_current_chars(self) -> None:
+        for i in range(len(self._character_data)):
+            char_id = self._character_data[i]['chara_id']
+            
+            if str(char_id) in self.all_character_data:
+                gettime = self._character_data[i]['gettime']
+                self.add_char(char_id, gettime = gettime, group = True)
+
+    def max_out_character_list(self) -> None:
+        self.max_all_current_chars()
+        self.add_all_missing_chars()
+
+    def _create_max_character(self, char_id: int, has_spiral: bool = False,
+                              shared_skill_cost: int = 0, max_hp: int = 0,
+                              max_atk: int = 0, stories: list[int] = None,
+                              gettime: int = None) -> 'Character':
+        if str(char_id) in self.all_character_data:
+            char_data = self.all_character_data[str(char_id)].copy()
+            has_spiral = 'ManaSpiralDate' in char_data
+            shared_skill_cost = char_data['EditSkillCost']
+            
+            if has_spiral:
+                max_hp = char_data['AddMaxHp1'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['PlusHp5'] + char_data['McFullBonusHp5']
+                max_atk = char_data['AddMaxAtk1'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['PlusAtk5'] + char_data['McFullBonusAtk5']
+            else:
+                max_hp = char_data['MaxHp'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['McFullBonusHp5']
+                max_atk = char_data['MaxAtk'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['McFullBonusAtk5']
+
+        mc_list = []
+        mc_level = 70 if has_spiral else 50
+
+        for i in range(1, mc_level + 1):
+            mc_list.append(i)
+
+        new_char = dict()
+        new_char['chara_id'] = char_id
+        new_char['rarity'] = 5
+        new_char['exp'] = 8866950 if has_spiral else 1191950
+        new_char['level'] = 100 if has_spiral else 80
+        new_char['additional_max_level'] = 20 if has_spiral else 0
+        new_char['hp_plus_count'] = 100
+        new_char['attack_plus_count'] = 100
+        new_char['limit_break_count'] = 5 if has_spiral else 4
+        new_char['is_new'] = 1
+        new_char['gettime'] = gettime if gettime != None else int(time.time())
+        new_char['skill_1_level'] = 4 if has_spiral else 3
+        new_char['skill_2_level'] = 3 if has_spiral else 2
+        new_char['ability_1_level'] = 3 if has_spiral else 2
+        new_char['ability_2_level'] = 3 if has_spiral else 2
+        new_char['ability_3_level'] = 2
+        new_char['burst_attack_level'] = 2
+        new_char['combo_buildup_count'] = 1 if has_spiral else 0
+        new_char['hp'] = max_hp
+        new_char['attack'] = max_atk
+        new_char['ex_ability_level'] = 5
+        new_char['ex_ability_2_level'] = 5
+        new_char['is_temporary'] = 0
+        new_char['is_unlock_edit_skill'] = shared_skill_cost
+        new_char['mana_circle_piece_id_list'] = mc_list
+        new_char['list_view_flag'] = 1
+
+        self._add_stories(char_id, stories)
+        
+        return new_char
+
+    def _add_adv_encyclo_bonus(self, elem: int, hp: float = 0,
+                               atk: float = 0) -> None:
+        if 1 <= elem <= 5:
+            self._adv_encyclo[elem - 1]['hp'] = math.fsum([self._adv_encyclo[elem - 1]['hp'], hp])
+            self._adv_encyclo[elem - 1]['attack'] = math.fsum([self._adv_encyclo[elem - 1]['attack'], atk])
+
+    def _add_dragon_encyclo_bonus(self, elem: int, hp: float = 0,
+                                  atk: float = 0) -> None:
+        if 1 <= elem <= 5: 
+            self._dragon_encyclo[elem - 1]['hp'] = math.fsum([self._dragon_encyclo[elem - 1]['hp'], hp])
+            self._dragon_encyclo[elem - 1]['attack'] = math.fsum([self._dragon_encyclo[elem - 1]['attack'], atk])
+        
+    def _add_stories(self, char_id: int, stories: list[int] = None) -> None:
+        current_stories = set()
+
+        for story in self._stories:
+            current_stories.add(story['unit_story_id'])
+
+        if stories == None:
+            if str(char_id) in self.story_data:
+                for story in self.story_data[str(char_id)]:
+                    if int(story) not in current_stories:
+                        self._add_story(int(story))
+        else:
+            for story in stories:
+                if story not in current_stories:
+                    self._add_story(story)
+
+    def _add_story(self, story_id: int, is_read: int = 0) -> None:
+        self._stories.append({'unit_story_id': story_id, 'is_read': is_read})
+
+    # unit stories
+
+    def mark_all_stories_read(self) -> int:
+        count = 0
+        for story in self._stories:
+            if story.get('is_read') != 1:
+                story['is_read'] = 1
+                count += 1
+        return count
+
+    def mark_stories_read(self, char_ids: list[int]) -> int:
+        count = 0
+        for char_id in char_ids:
+            for story_id in self.story_data.get(str(char_id), []):
+                for story in self._stories:
+                    if story['unit_story_id'] == int(story_id):
+                        if story.get('is_read') != 1:
+                            story['is_read'] = 1
+                            count += 1
+                        break
+        return count
+
+    def remove_orphaned_stories(self) -> int:
+        owned = [char['chara_id'] for char in self._character_data]
+        kept = []
+        for story in self._stories:
+            orphaned = False
+            for char_id, story_ids in self.story_data.items():
+                if int(char_id) not in owned and story['unit_story_id'] in [int(s) for s in story_ids]:
+                    orphaned = True
+                    break
+            if not orphaned:
+                kept.append(story)
+
+        count = len(self._stories) - len(kept)
+        if count != 0:
+            self._data['data']['unit_story_list'] = kept
+            self._stories = kept
+        return count
@@ -0,0 +1,203 @@
+# benchmarks/run_benchmarks.py
+#
+# run from the repository root with: python -m benchmarks.run_benchmarks
+
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import builtins
+import io
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import dragalia_save_editor_interface
+import json_handling
+from benchmarks import save_generator
+
+DEFAULT_BASELINE = ROOT / 'benchmarks' / 'baseline.json'
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.25
+
+def _load(path: str, reference_data: json_handling.ReferenceData) -> None:
+    json_handling.DragaliaSaveFile(path, reference_data)
+
+def _add_all_missing_chars(save_file: json_handling.DragaliaSaveFile) -> None:
+    save_file.add_all_missing_chars()
+
+def _max_all_current_chars(save_file: json_handling.DragaliaSaveFile) -> None:
+    save_file.max_all_current_chars()
+
+def _update(save_file: json_handling.DragaliaSaveFile) -> None:
+    save_file._update()
+
+def _view_characters(save_file: json_handling.DragaliaSaveFile) -> None:
+    interface = dragalia_save_editor_interface.DragaliaSaveEditorInterface()
+    interface._json = save_file
+    # answer "no" to the filter prompt and throw away the printed roster
+    original_input = builtins.input
+    builtins.input = lambda *args: 'N'
+    try:
+        with redirect_stdout(io.StringIO()):
+            interface._view_characters()
+    finally:
+        builtins.input = original_input
+
+# every operation except load runs against a freshly loaded save, the load
+# itself is not part of the measurement
+OPERATIONS = {
+    'load': None,
+    'add_all_missing_chars': _add_all_missing_chars,
+    'max_all_current_chars': _max_all_current_chars,
+    'update': _update,
+    'view_characters': _view_characters}
+
+def _max_rss_kb() -> int:
+    if resource == None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos reports bytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def _run_once(operation: str, path: str,
+              reference_data: json_handling.ReferenceData) -> 'Function':
+    if operation == 'load':
+        return lambda: _load(path, reference_data)
+    save_file = json_handling.DragaliaSaveFile(path, reference_data)
+    return lambda: OPERATIONS[operation](save_file)
+
+def _measure(profile: str, operation: str, repeats: int, seed: int,
+             extra_stories: int, results: 'Queue') -> None:
+    # runs in its own process so peak rss belongs to this case alone
+    reference_data = json_handling.ReferenceData()
+    document = save_generator.generate_save(profile, seed, reference_data,
+                                            extra_stories = extra_stories)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'save.txt')
+        times = []
+
+        for _ in range(repeats):
+            save_generator.write_save(path, document)
+            run = _run_once(operation, path, reference_data)
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        save_generator.write_save(path, document)
+        run = _run_once(operation, path, reference_data)
+        rss_before = _max_rss_kb()
+        tracemalloc.start()
+        run()
+        _, alloc_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = _max_rss_kb()
+
+    results.put({
+        'seconds': statistics.median(times),
+        'alloc_peak_bytes': alloc_peak,
+        'rss_peak_kb': rss_after,
+        'rss_growth_kb': rss_after - rss_before})
+
+def run_case(profile: str, operation: str, repeats: int = DEFAULT_REPEATS,
+             seed: int = 0, extra_stories: int = 0) -> dict:
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    process = context.Process(target = _measure,
+                              args = (profile, operation, repeats, seed, extra_stories, results))
+    process.start()
+
+    while True:
+        try:
+            result = results.get(timeout = 1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f'Benchmark case {profile}/{operation} failed')
+
+    process.join()
+    return result
+
+def run_benchmarks(profiles: list[str], operations: list[str],
+                   repeats: int = DEFAULT_REPEATS, seed: int = 0,
+                   extra_stories: int = 0) -> dict:
+    results = dict()
+    for profile in profiles:
+        for operation in operations:
+            results[f'{profile}/{operation}'] = run_case(profile, operation, repeats,
+                                                         seed, extra_stories)
+    return results
+
+def compare(results: dict, baseline: dict,
+            tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for metric in ('seconds', 'alloc_peak_bytes'):
+            old = baseline[case][metric]
+            if old > 0 and result[metric] > old * (1 + tolerance):
+                regressions.append(f'{case} {metric}: {old} -> {result[metric]} \
+({result[metric] / old:.2f}x)')
+    return regressions
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    print(f"{'case':<40}{'time (ms)':>12}{'vs base':>9}{'alloc (KiB)':>13}{'rss (KiB)':>11}{'rss +':>9}")
+    for case, result in results.items():
+        ratio = ''
+        if baseline != None and case in baseline and baseline[case]['seconds'] > 0:
+            ratio = f"{result['seconds'] / baseline[case]['seconds']:.2f}x"
+        print(f"{case:<40}{result['seconds'] * 1000:>12.2f}{ratio:>9}\
+{result['alloc_peak_bytes'] / 1024:>13.0f}{result['rss_peak_kb']:>11}{result['rss_growth_kb']:>9}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark save loading and editing.')
+    parser.add_argument('--profile', action = 'append', choices = save_generator.PROFILES)
+    parser.add_argument('--operation', action = 'append', choices = sorted(OPERATIONS))
+    parser.add_argument('--repeats', type = int, default = DEFAULT_REPEATS)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--extra-stories', type = int, default = 0,
+                        help = 'pad every save with this many synthetic unit stories')
+    parser.add_argument('--baseline', type = Path, default = DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action = 'store_true',
+                        help = 'store these results as the new baseline')
+    parser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.profile or list(save_generator.PROFILES),
+                             args.operation or list(OPERATIONS),
+                             args.repeats, args.seed, args.extra_stories)
+
+    baseline = None
+    if args.baseline.is_file():
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent = 2)
+        print(f'Saved baseline to {args.baseline}.')
+    elif baseline != None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if len(regressions) != 0:
+            sys.exit(1)
@@ -0,0 +1,129 @@
+# benchmarks/save_generator.py
+
+import json
+import random
+import json_handling
+
+PROFILES = ('empty', 'partial', 'maxed')
+
+# first synthetic unit story id used to pad saves past the real catalog size,
+# well outside the range of real story ids
+EXTRA_STORY_START = 900000001
+
+def _user_data(rng: random.Random, epithet_data: dict) -> dict:
+    return {
+        'viewer_id': rng.randint(100000000, 999999999),
+        'name': f'Bench{rng.randint(0, 9999):04d}',
+        'level': rng.randint(1, 250),
+        'exp': rng.randint(0, 10000000),
+        'crystal': rng.randint(0, 2147483647),
+        'coin': rng.randint(0, 2000000000),
+        'mana_point': rng.randint(0, 2000000000),
+        'dew_point': rng.randint(0, 2000000000),
+        'emblem_id': int(rng.choice(sorted(key for key in epithet_data if key.isdigit()))),
+        'max_dragon_quantity': 500,
+        'max_weapon_quantity': 0,
+        'max_amulet_quantity': 0}
+
+def _encyclo_bonuses() -> list:
+    return [{'elemental_type': elem, 'hp': 0.0, 'attack': 0.0} for elem in range(1, 6)]
+
+def _character(char_id: int, char_data: dict, rng: random.Random, gettime: int) -> dict:
+    # a character somewhere below max stats
+    mc_level = rng.randint(0, 50)
+
+    return {
+        'chara_id': char_id,
+        'rarity': rng.randint(3, 5),
+        'exp': rng.randint(0, 1191950),
+        'level': rng.randint(1, 80),
+        'additional_max_level': 0,
+        'hp_plus_count': rng.randint(0, 100),
+        'attack_plus_count': rng.randint(0, 100),
+        'limit_break_count': rng.randint(0, 4),
+        'is_new': 0,
+        'gettime': gettime,
+        'skill_1_level': rng.randint(1, 3),
+        'skill_2_level': rng.randint(1, 2),
+        'ability_1_level': rng.randint(1, 2),
+        'ability_2_level': rng.randint(1, 2),
+        'ability_3_level': 2,
+        'burst_attack_level': 2,
+        'combo_buildup_count': 0,
+        'hp': char_data['MaxHp'],
+        'attack': char_data['MaxAtk'],
+        'ex_ability_level': rng.randint(1, 5),
+        'ex_ability_2_level': rng.randint(1, 5),
+        'is_temporary': 0,
+        'is_unlock_edit_skill': 0,
+        'mana_circle_piece_id_list': list(range(1, mc_level + 1)),
+        'list_view_flag': 1}
+
+def _max_character(char_id: int, reference_data: json_handling.ReferenceData,
+                   gettime: int) -> dict:
+    # exactly what the editor writes when it maxes a character out, without
+    # the is_new flag a fresh add would have
+    char = json_handling.build_max_character(char_id, reference_data.all_character_data,
+                                             gettime = gettime)
+    char['is_new'] = 0
+    return char
+
+def generate_save(profile: str = 'partial', seed: int = 0,
+                  reference_data: json_handling.ReferenceData = None,
+                  roster_fraction: float = 0.5, extra_stories: int = 0) -> dict:
+    # the same profile, seed and catalog always produce the same save
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown profile: {profile}')
+    if reference_data == None:
+        reference_data = json_handling.ReferenceData()
+
+    rng = random.Random(seed)
+    catalog = sorted(reference_data.all_character_data)
+    catalog.remove('19900004')
+
+    if profile == 'empty':
+        owned = []
+    elif profile == 'partial':
+        owned = sorted(rng.sample(catalog, int(len(catalog) * roster_fraction)))
+    else:
+        owned = catalog
+
+    characters = []
+    stories = []
+    gettime = 1600000000
+    for char_id in owned:
+        gettime += rng.randint(60, 86400)
+        if profile == 'maxed':
+            characters.append(_max_character(int(char_id), reference_data, gettime))
+        else:
+            characters.append(_character(int(char_id), reference_data.all_character_data[char_id],
+                                         rng, gettime))
+
+        for story in reference_data.story_data.get(char_id, []):
+            if profile == 'maxed' or rng.random() < 0.6:
+                stories.append({'unit_story_id': int(story), 'is_read': rng.randint(0, 1)})
+
+    for story in range(EXTRA_STORY_START, EXTRA_STORY_START + extra_stories):
+        stories.append({'unit_story_id': story, 'is_read': rng.randint(0, 1)})
+
+    adv_encyclo = _encyclo_bonuses()
+    for char in characters:
+        elem = int(str(char['chara_id'])[5])
+        bonus = 0.3 if char['level'] == 100 else 0.2
+        adv_encyclo[elem - 1]['hp'] = round(adv_encyclo[elem - 1]['hp'] + bonus, 1)
+        adv_encyclo[elem - 1]['attack'] = round(adv_encyclo[elem - 1]['attack'] + bonus, 1)
+
+    return {'data': {
+        'user_data': _user_data(rng, reference_data.epithet_data),
+        'chara_list': characters,
+        'dragon_list': [],
+        'weapon_body_list': [],
+        'ability_crest_list': [],
+        'fort_bonus_list': {
+            'chara_bonus_by_album': adv_encyclo,
+            'dragon_bonus_by_album': _encyclo_bonuses()},
+        'unit_story_list': stories}}
+
+def write_save(path: 'File path', document: dict) -> None:
+    with open(path, 'w') as file:
+        json.dump(document, file, indent = 2)
@@ -1,6 +1,8 @@
 # dragalia_save_editor_interface.py
 
+import argparse
 import file_handling
+import instrumentation
 import json_handling
 import time
 import sys
@@ -86,6 +88,58 @@ def _restructure_id(char_id: int) -> int:
     output = char_id[5] + char_id[2] + str(5 - int(char_id[3])) + char_id[6:]
     return output
 
+def summarize_character(char: dict, all_character_data: dict) -> dict:
+    char_id = str(char['chara_id'])
+
+    if char_id in all_character_data:
+        name = all_character_data[char_id]['FullName']
+    else:
+        name = 'Unknown'
+
+    try:
+        element = ELEMENT_INVERSE[char_id[5]]
+    except (KeyError, IndexError):
+        element = 'Unknown'
+
+    try:
+        weapon = WEAPON_INVERSE[char_id[2]]
+    except (KeyError, IndexError):
+        weapon = 'Unknown'
+
+    return {
+        'chara_id': char['chara_id'],
+        'name': name,
+        'rarity': char_id[3] if len(char_id) > 3 else 'Unknown',
+        'element': element,
+        'weapon': weapon,
+        'level': char['level'],
+        'mana_circle': len(char['mana_circle_piece_id_list']),
+        'augments': char['hp_plus_count'] + char['attack_plus_count'],
+        'gettime': char['gettime']}
+
+def format_profile(user_data: dict, epithets: dict) -> list[str]:
+    output = []
+
+    if str(user_data['emblem_id']) in epithets:
+        epithet = epithets[str(user_data['emblem_id'])]
+    else:
+        epithet = 'None'
+    
+    output.append(f'Player Name: {user_data["name"]}')
+    output.append(f'Epithet: {epithet}')
+    output.append(f'User ID: {user_data["viewer_id"]}')
+    output.append(f'Player Level: {_return_if_exists("level", user_data)}')
+    output.append('')
+    output.append(f'Wyrmite: {_pretty_print(_return_if_exists("crystal", user_data))}')
+    output.append(f'Rupies: {_pretty_print(_return_if_exists("coin", user_data))}')
+    output.append(f'Mana: {_pretty_print(_return_if_exists("mana_point", user_data))}')
+    output.append(f'Eldwater: {_pretty_print(_return_if_exists("dew_point", user_data))}')
+
+    return output
+
+def sort_characters(characters: list) -> list:
+    return sorted(characters, key = lambda char: int(_restructure_id(char['chara_id'])))
+
 def _proper(string: str) -> str:
     split_string = string.split(' ')
 
@@ -105,6 +159,7 @@ class DragaliaSaveEditorInterface:
     def __init__(self):
         self._save_file = None
         self._backup = None
+        self._compress_backup = False
         self._json = None
         self._running = True
         self._char_elem_filter = set()
@@ -138,15 +193,21 @@ inside the directory {file_handling.get_parent_directory(file)}?')
         print(f'Save file set to {file}.')
 
     def _ask_create_backup(self) -> None:
-        backup = file_handling.get_parent_directory(self._save_file)/'backup.txt'
         print('***It is highly recommended to have a backup file saved in case \
 something goes wrong.***')
 
+        # the name depends on compression, so ask about it before looking
+        # for an existing backup
+        self._compress_backup = _ask_y_n_question('Would you like a backup file \
+to be compressed? This saves space, your save file itself is not changed.')
+        backup_name = 'backup.txt.gz' if self._compress_backup else 'backup.txt'
+        backup = file_handling.get_parent_directory(self._save_file)/backup_name
+
         if file_handling.find_file(backup) == None:
             question = f'No backup file detected within this directory. Would \
 you like to create one?'
         else:
-            question = 'A file named backup.txt has been detected within this \
+            question = f'A file named {backup_name} has been detected within this \
 directory. Would you still like to create a backup file?'
 
         response = _ask_y_n_question(question)
@@ -205,12 +266,14 @@ name of the backup file will default to what it is set to currently, \
         self._backup = backup_directory / backup_name
         warning = ''
         
+        suffixes = ['.txt', '.gz'] if self._compress_backup else ['.txt']
+
         if len(self._backup.suffixes) == 0:
-            self._backup = backup_directory / f'{backup_name}.txt'
+            self._backup = backup_directory / f"{backup_name}{''.join(suffixes)}"
         else:
-            if not len(self._backup.suffixes) == 1 or not self._backup.suffix == '.txt':
-                warning = f'***WARNING***\n{backup_name} does not appear to \
-be a txt file, which may cause the file to be corrupted/unreadable.\n'
+            if self._backup.suffixes != suffixes:
+                warning = f"***WARNING***\n{backup_name} does not appear to \
+be a {''.join(suffixes)} file, which may cause the file to be corrupted/unreadable.\n"
 
         response = _ask_y_n_question(f'{warning}Create backup file at {self._backup}?')
 
@@ -230,7 +293,8 @@ be a txt file, which may cause the file to be corrupted/unreadable.\n'
 
     def _create_backup_file(self) -> None:
         try:
-            file_handling.copy_file(self._save_file, self._backup)
+            compression = file_handling.GZIP if self._compress_backup else None
+            file_handling.copy_file(self._save_file, self._backup, compression)
             print(f'Created backup file at {self._backup}.')
         except file_handling.CopyFileError:
             response = _ask_y_n_question(f'Failed to create backup file at \
@@ -277,6 +341,8 @@ Please make sure that the given file is your Dragalia save file.')
             'Dragons',
             'Wyrmprints',
             'Weapons',
+            'Undo Last Change',
+            'Redo',
             'Quit Editor']
 
         _print_mc_question(options, 'Please select one of the following.')
@@ -307,7 +373,21 @@ Please make sure that the given file is your Dragalia save file.')
                     print('Not implemented yet')
                     return
 
-                case '6' | 'QUIT EDITOR' | 'QUIT' | 'Q' | 'EXIT':
+                case '6' | 'UNDO LAST CHANGE' | 'UNDO' | 'U':
+                    if self._json.undo():
+                        print('Undid the last change.')
+                    else:
+                        print('There is nothing to undo.')
+                    return
+
+                case '7' | 'REDO' | 'R':
+                    if self._json.redo():
+                        print('Redid the last undone change.')
+                    else:
+                        print('There is nothing to redo.')
+                    return
+
+                case '8' | 'QUIT EDITOR' | 'QUIT' | 'Q' | 'EXIT':
                     self._ask_quit_editor()
                     return
 
@@ -337,26 +417,7 @@ Please make sure that the given file is your Dragalia save file.')
                     print('Invalid input, please try again.')
 
     def _display_user_data(self) -> None:
-        output = []
-        user_data = self._json.get_user_data()
-        epithets = self._json.epithet_data
-
-        if str(user_data['emblem_id']) in epithets:
-            epithet = epithets[str(user_data['emblem_id'])]
-        else:
-            epithet = 'None'
-        
-        output.append(f'Player Name: {user_data["name"]}')
-        output.append(f'Epithet: {epithet}')
-        output.append(f'User ID: {user_data["viewer_id"]}')
-        output.append(f'Player Level: {_return_if_exists("level", user_data)}')
-        output.append('')
-        output.append(f'Wyrmite: {_pretty_print(_return_if_exists("crystal", user_data))}')
-        output.append(f'Rupies: {_pretty_print(_return_if_exists("coin", user_data))}')
-        output.append(f'Mana: {_pretty_print(_return_if_exists("mana_point", user_data))}')
-        output.append(f'Eldwater: {_pretty_print(_return_if_exists("dew_point", user_data))}')
-
-        _box_print(output)
+        _box_print(format_profile(self._json.get_user_data(), self._json.epithet_data))
 
     def _modify_user_data(self) -> None:
         options = [
@@ -475,6 +536,7 @@ characters in your collection.')
             'Add All Missing Characters (from original game)(comes with max stats)',
             'Max Out All Current Characters (from original game)',
             'Max Out Account (adds and maxes out all characters from original game)',
+            'Unit Stories',
             'Back']
 
         _print_mc_question(options)
@@ -503,7 +565,12 @@ characters in your collection.')
                     self._max_character_list()
                     return True
 
-                case '6' | 'BACK' | 'B' | 'QUIT' | 'Q' | 'EXIT':
+                case '6' | 'UNIT STORIES' | 'STORIES' | 'STORY':
+                    while self._stories():
+                        continue
+                    return True
+
+                case '7' | 'BACK' | 'B' | 'QUIT' | 'Q' | 'EXIT':
                     return False
 
                 case _:
@@ -529,33 +596,15 @@ to set one?')
 
         characters = self._json.get_character_data()
         all_characters = self._json.all_character_data
-        characters = sorted(characters, key = lambda char: int(_restructure_id(char['chara_id'])))
+        characters = sort_characters(characters)
 
         for char in characters:
             if (len(self._char_elem_filter) == 0 or (str(char['chara_id'])[5] in ELEMENT_INVERSE and ELEMENT_INVERSE[str(char['chara_id'])[5]].upper() in self._char_elem_filter)) and (len(self._char_weapon_filter) == 0 or (str(char['chara_id'])[2] in WEAPON_INVERSE and WEAPON_INVERSE[str(char['chara_id'])[2]].upper() in self._char_weapon_filter)):
-                if str(char['chara_id']) in all_characters:
-                    name = all_characters[str(char['chara_id'])]['FullName']
-                else:
-                    name = 'Unknown'
-                rarity = str(char['chara_id'])[3]
-                
-                try:
-                    element = ELEMENT_INVERSE[str(char['chara_id'])[5]]
-                except KeyError:
-                    element = 'Unknown'
-
-                try:
-                    weapon = WEAPON_INVERSE[str(char['chara_id'])[2]]
-                except KeyError:
-                    weapon = 'Unknown'
-                    
-                level = char['level']
-                mc = len(char['mana_circle_piece_id_list'])
-                augments = char['hp_plus_count'] + char['attack_plus_count']
+                summary = summarize_character(char, all_characters)
                 gettime = time.strftime('%A, %B %d, %Y at %H:%M:%S',
-                                        time.localtime(char['gettime']))
-                print(f'{name} ({rarity}* {element}/{weapon})')
-                print(f'Level {level} | {mc} MC | +{augments}')
+                                        time.localtime(summary['gettime']))
+                print(f"{summary['name']} ({summary['rarity']}* {summary['element']}/{summary['weapon']})")
+                print(f"Level {summary['level']} | {summary['mana_circle']} MC | +{summary['augments']}")
                 print(f'Obtained on {gettime}.')
                 print()
 
@@ -679,6 +728,60 @@ their stats will be maxed out.')
         self._json.max_out_character_list()
         print('Maxed out all characters.')
             
+    def _stories(self) -> bool:
+        stories = self._json.get_stories()
+        num_read = sum(1 for story in stories if story.get('is_read') == 1)
+        print(f'You currently have {len(stories)} unit stories, {num_read} of them read.')
+
+        options = [
+            'Mark All Stories Read',
+            'Mark Stories Read For Characters',
+            'Remove Stories Of Characters You Do Not Own',
+            'Back']
+
+        _print_mc_question(options)
+
+        while True:
+            selection = input().strip().upper()
+
+            match selection:
+                case '1' | 'MARK ALL STORIES READ' | 'MARK ALL READ' | 'MARK ALL':
+                    print(f'Marked {self._json.mark_all_stories_read()} stories as read.')
+                    return True
+
+                case '2' | 'MARK STORIES READ FOR CHARACTERS' | 'MARK CHARACTERS' | 'MARK':
+                    self._mark_character_stories_read()
+                    return True
+
+                case '3' | 'REMOVE STORIES OF CHARACTERS YOU DO NOT OWN' | 'REMOVE ORPHANED' | 'REMOVE':
+                    print(f'Removed {self._json.remove_orphaned_stories()} stories.')
+                    return True
+
+                case '4' | 'BACK' | 'B' | 'QUIT' | 'Q' | 'EXIT':
+                    return False
+
+                case _:
+                    print('Invalid response, please try again.')
+
+    def _mark_character_stories_read(self) -> None:
+        print('Which characters? (names or ids in a comma separated list)')
+
+        while True:
+            char_ids = []
+            for entry in input().split(','):
+                char = _proper(entry.strip())
+                if _is_int(char) and char in self._json.all_character_data:
+                    char_ids.append(int(char))
+                elif char in self._json.all_character_names:
+                    char_ids.append(self._json.all_character_names[char])
+                else:
+                    print(f'Could not find {char}, please try again.')
+                    break
+            else:
+                break
+
+        print(f'Marked {self._json.mark_stories_read(char_ids)} stories as read.')
+
     def _ask_quit_editor(self) -> None:
         response = _ask_y_n_question('Are you sure you want to quit?')
         if response:
@@ -690,8 +793,25 @@ their stats will be maxed out.')
         self._set_save_file()
         self._ask_create_backup()
         self._load_json()
-        while self._running:
-            self._main_menu()
+        try:
+            while self._running:
+                self._main_menu()
+        except json_handling.StaleSaveFileError:
+            print('Your save file was changed by another program after it was \
+loaded, so your latest change was not saved. Please restart the editor.')
+            sys.exit()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Interactive Dragalia Lost save editor.')
+    parser.add_argument('--instrument', metavar = 'SINKS',
+                        help = 'comma separated instrumentation sinks, e.g. \
+log,json=metrics.json,cprofile=profile.out,tracemalloc=allocations.txt')
+    args = parser.parse_args()
+
+    if args.instrument != None:
+        try:
+            instrumentation.configure(args.instrument)
+        except instrumentation.InstrumentationConfigError as error:
+            print(f'Warning: instrumentation is off. {error}')
+
     DragaliaSaveEditorInterface().run()
@@ -0,0 +1,291 @@
+# edit_service.py
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import json
+import threading
+import dragalia_save_editor_interface
+import json_handling
+import reference_catalog
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_POOL_SIZE = 64
+# host names a browser may use to reach the service, anything else in the
+# Host header is refused so that dns rebinding cannot reach it
+LOCAL_HOST_NAMES = ('127.0.0.1', 'localhost', '[::1]')
+
+LOAD_ERRORS = (json_handling.FileConversionError,
+               json_handling.UserDataNotFoundError,
+               json_handling.CharactersNotFoundError,
+               json_handling.EncyclopediaBonusesNotFoundError,
+               json_handling.UnitStoryListNotFoundError)
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class SavePool:
+    # keeps the most recently used saves open so repeat requests skip the
+    # load. each save has its own lock, so edits to one file are applied one
+    # at a time while different files can be edited in parallel. pooled
+    # saves are moved to the catalog's newest game data between requests
+    def __init__(self, catalog: reference_catalog.ReferenceCatalog,
+                 max_size: int = DEFAULT_POOL_SIZE):
+        self._catalog = catalog
+        self._max_size = max_size
+        self._saves = OrderedDict()
+        self._snapshots = dict()
+        self._file_locks = dict()
+        self._pool_lock = threading.Lock()
+
+    def _get_file_lock(self, key: str) -> threading.Lock:
+        with self._pool_lock:
+            if key not in self._file_locks:
+                self._file_locks[key] = threading.Lock()
+            return self._file_locks[key]
+
+    def _get_cached(self, key: str) -> json_handling.DragaliaSaveFile:
+        with self._pool_lock:
+            if key in self._saves:
+                self._saves.move_to_end(key)
+                return self._saves[key]
+        return None
+
+    def _store(self, key: str, save_file: json_handling.DragaliaSaveFile) -> None:
+        with self._pool_lock:
+            self._saves[key] = save_file
+            self._saves.move_to_end(key)
+
+            while len(self._saves) > self._max_size:
+                evicted, _ = self._saves.popitem(last = False)
+                self._snapshots.pop(evicted, None)
+                lock = self._file_locks.get(evicted)
+                if lock != None and not lock.locked():
+                    del self._file_locks[evicted]
+
+    @contextmanager
+    def open(self, path: str | Path) -> json_handling.DragaliaSaveFile:
+        key = str(Path(path).resolve())
+        lock = self._get_file_lock(key)
+
+        with lock:
+            snapshot = self._catalog.snapshot()
+            save_file = self._get_cached(key)
+            if save_file == None:
+                if not Path(key).is_file():
+                    raise RequestError(404, f'No save file at {key}')
+                try:
+                    save_file = json_handling.DragaliaSaveFile(key, snapshot)
+                except LOAD_ERRORS as error:
+                    raise RequestError(422, f'{type(error).__name__}: {key} is not a valid save file')
+                self._store(key, save_file)
+            elif self._snapshots.get(key) is not snapshot:
+                save_file.set_reference_data(snapshot)
+            self._snapshots[key] = snapshot
+
+            with save_file.lock():
+                # pick up changes made by other processes since the save
+                # was pooled instead of overwriting them
+                if save_file.is_stale():
+                    try:
+                        save_file.reload()
+                    except (LOAD_ERRORS + (OSError,)) as error:
+                        self.discard(key)
+                        raise RequestError(422, f'{type(error).__name__}: {key} is not a valid save file')
+                yield save_file
+
+    def discard(self, path: str | Path) -> None:
+        key = str(Path(path).resolve())
+        with self._pool_lock:
+            self._saves.pop(key, None)
+            self._snapshots.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._saves)
+
+def _require(params: dict, field: str) -> object:
+    if field not in params:
+        raise RequestError(400, f'Missing field: {field}')
+    return params[field]
+
+def _user_data(save_file: json_handling.DragaliaSaveFile, params: dict) -> dict:
+    return save_file.get_user_data()
+
+def _roster(save_file: json_handling.DragaliaSaveFile, params: dict) -> list:
+    characters = dragalia_save_editor_interface.sort_characters(save_file.get_character_data())
+    return [dragalia_save_editor_interface.summarize_character(char, save_file.all_character_data)
+            for char in characters]
+
+def _modify_user_data(save_file: json_handling.DragaliaSaveFile, params: dict) -> None:
+    field = _require(params, 'field')
+    value = _require(params, 'value')
+    if not isinstance(field, str) or not isinstance(value, (int, str)):
+        raise RequestError(400, 'field must be a string and value an int or string')
+    save_file.modify_user_data(field, value)
+
+def _add_char(save_file: json_handling.DragaliaSaveFile, params: dict) -> bool:
+    # like the editor, only characters in the game data can be added, by id
+    # or by name
+    char = _require(params, 'char_id')
+    if isinstance(char, str) and char in save_file.all_character_names:
+        char = save_file.all_character_names[char]
+    if isinstance(char, bool) or not isinstance(char, (int, str)) or str(char) not in save_file.all_character_data:
+        raise RequestError(400, f'Unknown character: {char}')
+    return save_file.add_char(int(char))
+
+def _add_all_missing_chars(save_file: json_handling.DragaliaSaveFile, params: dict) -> int:
+    return save_file.add_all_missing_chars()
+
+def _max_all_current_chars(save_file: json_handling.DragaliaSaveFile, params: dict) -> None:
+    save_file.max_all_current_chars()
+
+def _max_out_character_list(save_file: json_handling.DragaliaSaveFile, params: dict) -> None:
+    save_file.max_out_character_list()
+
+OPERATIONS = {
+    'user_data': _user_data,
+    'roster': _roster,
+    'modify_user_data': _modify_user_data,
+    'add_char': _add_char,
+    'add_all_missing_chars': _add_all_missing_chars,
+    'max_all_current_chars': _max_all_current_chars,
+    'max_out_character_list': _max_out_character_list}
+
+class EditService:
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, watch_reference_data: bool = True,
+                 save_root: str | Path = '.'):
+        # only saves inside save_root can be opened, relative paths are
+        # taken from it
+        self.save_root = Path(save_root).resolve()
+        self.catalog = reference_catalog.ReferenceCatalog()
+        if watch_reference_data:
+            self.catalog.start_watching()
+        self.pool = SavePool(self.catalog, pool_size)
+
+    def handle(self, operation: str, params: dict) -> object:
+        if operation not in OPERATIONS:
+            raise RequestError(404, f'Unknown operation: {operation}')
+
+        path = self._resolve_path(_require(params, 'path'))
+        with self.pool.open(path) as save_file:
+            checkpoint = save_file.checkpoint()
+            try:
+                return OPERATIONS[operation](save_file, params)
+            except json_handling.StaleSaveFileError:
+                self.pool.discard(path)
+                raise RequestError(409, f'{path} was changed by another process, please retry')
+            except Exception as error:
+                # put the pooled copy back the way it was before this request.
+                # if that cannot be done completely the copy is dropped, the
+                # next request loads the save from disk again
+                recorded = save_file.checkpoint() - checkpoint
+                try:
+                    if save_file.rollback(checkpoint) < recorded:
+                        self.pool.discard(path)
+                except Exception:
+                    self.pool.discard(path)
+
+                if isinstance(error, json_handling.FileEncodingError):
+                    raise RequestError(500, f'Failed to write save file at {path}')
+                raise
+
+    def _resolve_path(self, path: object) -> Path:
+        if not isinstance(path, str):
+            raise RequestError(400, 'path must be a string')
+        resolved = (self.save_root / path).resolve()
+        if not resolved.is_relative_to(self.save_root):
+            raise RequestError(403, f'{path} is outside the save directory')
+        return resolved
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    service = None
+    allowed_hosts = ()
+
+    def _check_host(self) -> None:
+        if self.headers.get('Host', '').lower() not in self.allowed_hosts:
+            raise RequestError(403, 'Unexpected Host header')
+
+    def _send(self, status: int, body: dict) -> None:
+        encoded = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def do_GET(self) -> None:
+        try:
+            self._check_host()
+        except RequestError as error:
+            self._send(error.status, {'ok': False, 'error': str(error)})
+            return
+
+        if self.path == '/health':
+            self._send(200, {'ok': True, 'open_saves': len(self.service.pool),
+                             'reference_version': self.service.catalog.get_version()})
+        else:
+            self._send(404, {'ok': False, 'error': 'Use POST /<operation>'})
+
+    def do_POST(self) -> None:
+        try:
+            self._check_host()
+            # a browser can only send application/json cross-origin after a
+            # cors preflight, which this service never answers
+            content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type != 'application/json':
+                raise RequestError(415, 'Content-Type must be application/json')
+
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                params = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                raise RequestError(400, 'Request body must be a JSON object')
+            if not isinstance(params, dict):
+                raise RequestError(400, 'Request body must be a JSON object')
+
+            result = self.service.handle(self.path.strip('/'), params)
+            self._send(200, {'ok': True, 'result': result})
+        except RequestError as error:
+            self._send(error.status, {'ok': False, 'error': str(error)})
+        except Exception as error:
+            self._send(500, {'ok': False, 'error': f'{type(error).__name__}: {error}'})
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+def create_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                  pool_size: int = DEFAULT_POOL_SIZE, save_root: str | Path = '.') -> ThreadingHTTPServer:
+    handler = type('RequestHandler', (_RequestHandler,), {'service': EditService(pool_size, save_root = save_root)})
+    server = ThreadingHTTPServer((host, port), handler)
+
+    names = set(LOCAL_HOST_NAMES)
+    names.add(host.lower())
+    handler.allowed_hosts = frozenset(f'{name}:{server.server_port}' for name in names)
+    return server
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          pool_size: int = DEFAULT_POOL_SIZE, save_root: str | Path = '.') -> None:
+    server = create_server(host, port, pool_size, save_root)
+    print(f'Serving saves in {server.RequestHandlerClass.service.save_root}')
+    print(f'Dragalia save edit service listening on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serve save edits over local HTTP.')
+    parser.add_argument('--host', default = DEFAULT_HOST)
+    parser.add_argument('--port', type = int, default = DEFAULT_PORT)
+    parser.add_argument('--pool-size', type = int, default = DEFAULT_POOL_SIZE)
+    parser.add_argument('--save-root', default = '.',
+                        help = 'only saves inside this directory can be edited (default: current directory)')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.pool_size, args.save_root)
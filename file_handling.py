@@ -1,11 +1,25 @@
 # file_handling.py
 
 from pathlib import Path
+import gzip
 import shutil
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+# compression is recognised from the first bytes of a file, never its name
+MAGIC_BYTES = {GZIP: b'\x1f\x8b', ZSTD: b'\x28\xb5\x2f\xfd'}
+
 class CopyFileError(Exception):
     pass
 
+class CompressionUnavailableError(Exception):
+    pass
+
 def find_file(path: str | Path) -> 'File Path':
     try:
         file_path = Path(path)
@@ -32,8 +46,68 @@ def get_file_name(path: Path) -> str:
 def get_parent_directory(path: Path) -> Path:
     return path.parent
 
-def copy_file(source: Path, destination: Path) -> None:
+def detect_compression(raw: bytes) -> str:
+    for compression, magic in MAGIC_BYTES.items():
+        if raw[:len(magic)] == magic:
+            return compression
+    return None
+
+def detect_file_compression(path: str | Path) -> str:
+    with open(path, 'rb') as file:
+        return detect_compression(file.read(4))
+
+def _require_zstandard() -> None:
+    if zstandard == None:
+        raise CompressionUnavailableError('zstd support needs the zstandard package')
+
+def decompress(raw: bytes, compression: str = None) -> bytes:
+    if compression == None:
+        compression = detect_compression(raw)
+
+    if compression == GZIP:
+        return gzip.decompress(raw)
+    if compression == ZSTD:
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    return raw
+
+def compress(raw: bytes, compression: str) -> bytes:
+    if compression == GZIP:
+        # a fixed header time keeps identical saves byte-identical
+        return gzip.compress(raw, mtime = 0)
+    if compression == ZSTD:
+        _require_zstandard()
+        return zstandard.ZstdCompressor().compress(raw)
+    return raw
+
+def read_file(path: str | Path) -> bytes:
+    with open(path, 'rb') as file:
+        return decompress(file.read())
+
+def open_for_reading(path: str | Path) -> 'Binary file':
+    # a stream of the file's contents, decompressed on the fly if needed
+    compression = detect_file_compression(path)
+    if compression == GZIP:
+        return gzip.open(path, 'rb')
+    if compression == ZSTD:
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd = True)
+    return open(path, 'rb')
+
+def open_for_writing(path: str | Path, compression: str = None) -> 'Binary file':
+    if compression == GZIP:
+        return gzip.GzipFile(path, 'wb', mtime = 0)
+    if compression == ZSTD:
+        _require_zstandard()
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd = True)
+    return open(path, 'wb')
+
+def copy_file(source: Path, destination: Path, compression: str = None) -> None:
     try:
-        shutil.copyfile(source, destination)
+        if compression == None:
+            shutil.copyfile(source, destination)
+        else:
+            with open_for_reading(source) as reader, open_for_writing(destination, compression) as writer:
+                shutil.copyfileobj(reader, writer)
     except:
         raise CopyFileError
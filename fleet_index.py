@@ -0,0 +1,301 @@
+# fleet_index.py
+#
+# a local sqlite database describing many saves, so that questions such as
+# "which saves are missing this adventurer" can be answered with a query
+# instead of loading every save. indexing is incremental: a file whose mtime
+# and size are unchanged is skipped without being read, and a file that was
+# only touched is recognised by its hash and not parsed again. changed saves
+# are read by a pool of workers that parse only user_data, chara_list and
+# unit_story_list.
+#
+# the paths returned by the query helpers can be passed straight to
+# batch_processing.run_batch.
+
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePath
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import batch_processing
+import file_handling
+import save_validation
+
+DEFAULT_DATABASE = 'fleet.db'
+CRYSTAL_CAP = 2147483647
+
+# user_data fields that get their own column, the whole of user_data is
+# kept as json as well
+USER_DATA_COLUMNS = ('viewer_id', 'name', 'emblem_id', 'level', 'exp', 'crystal',
+                     'coin', 'mana_point', 'dew_point')
+
+_SECTIONS = {
+    ('data', 'user_data'): 'user_data',
+    ('data', 'chara_list'): 'chara_list',
+    ('data', 'unit_story_list'): 'unit_story_list'}
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS saves (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    indexed_at INTEGER NOT NULL,
+    {', '.join(f'{column} {"TEXT" if column == "name" else "INTEGER"}' for column in USER_DATA_COLUMNS)},
+    user_data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS characters (
+    path TEXT NOT NULL REFERENCES saves(path) ON DELETE CASCADE,
+    chara_id INTEGER NOT NULL,
+    level INTEGER,
+    mana_circle INTEGER,
+    PRIMARY KEY (path, chara_id));
+CREATE TABLE IF NOT EXISTS stories (
+    path TEXT NOT NULL REFERENCES saves(path) ON DELETE CASCADE,
+    unit_story_id INTEGER NOT NULL,
+    is_read INTEGER,
+    PRIMARY KEY (path, unit_story_id));
+CREATE INDEX IF NOT EXISTS characters_by_id ON characters (chara_id, path);
+CREATE INDEX IF NOT EXISTS stories_by_id ON stories (unit_story_id, path);
+CREATE INDEX IF NOT EXISTS saves_by_crystal ON saves (crystal);
+'''
+
+class FleetIndexError(Exception):
+    pass
+
+def _glob_match(parts: tuple, pattern_parts: tuple) -> bool:
+    # the same matching Path.glob uses: * stays within one directory and
+    # ** matches any number of them
+    if len(pattern_parts) == 0:
+        return len(parts) == 0
+    if pattern_parts[0] == '**':
+        return any(_glob_match(parts[i:], pattern_parts[1:]) for i in range(len(parts) + 1))
+    return len(parts) != 0 and fnmatchcase(parts[0], pattern_parts[0]) \
+        and _glob_match(parts[1:], pattern_parts[1:])
+
+def _is_listed_by(path: str, root: Path, pattern: str) -> bool:
+    # whether path would be found by find_saves(root, pattern) if it existed
+    try:
+        relative = PurePath(path).relative_to(root)
+    except ValueError:
+        return False
+    return _glob_match(relative.parts, PurePath(pattern).parts)
+
+def _read_save(task: tuple) -> dict:
+    # runs in a worker. known_hash is the hash already in the index, if it
+    # matches the file is not parsed
+    path, known_hash = task
+    result = {'path': path, 'error': None, 'changed': False}
+
+    try:
+        with open(path, 'rb') as file:
+            raw = file.read()
+            stat = os.fstat(file.fileno())
+        result['mtime_ns'] = stat.st_mtime_ns
+        result['size'] = stat.st_size
+        result['sha256'] = hashlib.sha256(raw).hexdigest()
+        if result['sha256'] == known_hash:
+            return result
+
+        buffer = file_handling.decompress(raw, file_handling.detect_compression(raw))
+        spans = save_validation.locate_sections(buffer, list(_SECTIONS))
+        for section_path, name in _SECTIONS.items():
+            if section_path not in spans:
+                raise FleetIndexError(f'missing {".".join(section_path)}')
+            start, end = spans[section_path]
+            result[name] = json.loads(buffer[start:end])
+
+        result['characters'] = [(char['chara_id'], char.get('level'),
+                                 len(char.get('mana_circle_piece_id_list', [])))
+                                for char in result.pop('chara_list')]
+        result['stories'] = [(story['unit_story_id'], story.get('is_read'))
+                             for story in result.pop('unit_story_list')]
+        result['changed'] = True
+    except Exception as error:
+        result['error'] = batch_processing._describe_error(error)
+    return result
+
+class IndexReport:
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = []
+        self.elapsed = 0.0
+
+    def print_summary(self) -> None:
+        print(f'Indexed in {self.elapsed:.2f}s: {self.added} added, {self.updated} updated, \
+{self.unchanged} unchanged, {self.removed} removed.')
+        for path, error in sorted(self.failed):
+            print(f'  FAILED {path}: {error}')
+
+class FleetIndex:
+    def __init__(self, database: str | Path = DEFAULT_DATABASE):
+        self._connection = sqlite3.connect(str(database))
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def __enter__(self) -> 'FleetIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.close()
+        return False
+
+    def _known_files(self) -> dict:
+        return {path: (mtime_ns, size, sha256) for path, mtime_ns, size, sha256
+                in self._connection.execute('SELECT path, mtime_ns, size, sha256 FROM saves')}
+
+    def _store(self, result: dict) -> None:
+        user_data = result['user_data']
+        columns = ('path', 'mtime_ns', 'size', 'sha256', 'indexed_at') + USER_DATA_COLUMNS + ('user_data',)
+        values = [result['path'], result['mtime_ns'], result['size'], result['sha256'], int(time.time())]
+        values += [user_data.get(column) for column in USER_DATA_COLUMNS]
+        values.append(json.dumps(user_data))
+
+        # replacing the save row cascades to its characters and stories
+        self._connection.execute('DELETE FROM saves WHERE path = ?', (result['path'],))
+        self._connection.execute(f'INSERT INTO saves ({", ".join(columns)}) \
+VALUES ({", ".join("?" * len(columns))})', values)
+        self._connection.executemany('INSERT OR REPLACE INTO characters VALUES (?, ?, ?, ?)',
+                                     [(result['path'],) + char for char in result['characters']])
+        self._connection.executemany('INSERT OR REPLACE INTO stories VALUES (?, ?, ?)',
+                                     [(result['path'],) + story for story in result['stories']])
+
+    def index(self, paths: list[str], workers: int = None, prune_root: str | Path = None,
+              pattern: str = batch_processing.DEFAULT_PATTERN) -> IndexReport:
+        # with prune_root given, paths is taken to be the full listing of
+        # find_saves(prune_root, pattern), and indexed saves that listing
+        # would include but does not are removed. saves indexed from other
+        # directories or with other patterns are left alone
+        report = IndexReport()
+        start = time.perf_counter()
+        paths = [str(Path(path).resolve()) for path in paths]
+        known = self._known_files()
+
+        tasks = []
+        invalid = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as error:
+                report.failed.append((path, batch_processing._describe_error(error)))
+                invalid.append(path)
+                continue
+            if path in known and known[path][:2] == (stat.st_mtime_ns, stat.st_size):
+                report.unchanged += 1
+            else:
+                tasks.append((path, known[path][2] if path in known else None))
+
+        if len(tasks) != 0:
+            if workers == None:
+                workers = os.cpu_count() or 1
+            workers = max(1, min(workers, len(tasks)))
+
+            with batch_processing._get_context().Pool(workers) as pool, self._connection:
+                for result in pool.imap_unordered(_read_save, tasks, chunksize = 4):
+                    if result['error'] != None:
+                        report.failed.append((result['path'], result['error']))
+                        invalid.append(result['path'])
+                    elif not result['changed']:
+                        # touched but identical, only the stat is refreshed
+                        self._connection.execute('UPDATE saves SET mtime_ns = ?, size = ? WHERE path = ?',
+                                                 (result['mtime_ns'], result['size'], result['path']))
+                        report.unchanged += 1
+                    else:
+                        self._store(result)
+                        if result['path'] in known:
+                            report.updated += 1
+                        else:
+                            report.added += 1
+
+        # a save that can no longer be read has changed since it was indexed,
+        # keeping its old row would answer queries with stale data
+        invalid = [path for path in invalid if path in known]
+        if len(invalid) != 0:
+            with self._connection:
+                self._connection.executemany('DELETE FROM saves WHERE path = ?',
+                                             [(path,) for path in invalid])
+            report.removed += len(invalid)
+
+        if prune_root != None:
+            root = Path(prune_root).resolve()
+            removed = set(path for path in known if _is_listed_by(path, root, pattern)) - set(paths)
+            with self._connection:
+                self._connection.executemany('DELETE FROM saves WHERE path = ?',
+                                             [(path,) for path in removed])
+            report.removed += len(removed)
+
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        # ad hoc queries may only read
+        self._connection.execute('PRAGMA query_only = ON')
+        try:
+            return self._connection.execute(sql, parameters).fetchall()
+        finally:
+            self._connection.execute('PRAGMA query_only = OFF')
+
+    def _paths(self, sql: str, parameters: tuple = ()) -> list[str]:
+        return [row[0] for row in self._connection.execute(sql, parameters)]
+
+    def saves_with_character(self, chara_id: int) -> list[str]:
+        return self._paths('SELECT path FROM characters WHERE chara_id = ? ORDER BY path', (chara_id,))
+
+    def saves_missing_character(self, chara_id: int) -> list[str]:
+        return self._paths('SELECT path FROM saves WHERE NOT EXISTS (SELECT 1 FROM characters \
+WHERE characters.chara_id = ? AND characters.path = saves.path) ORDER BY path', (chara_id,))
+
+    def saves_missing_story(self, unit_story_id: int) -> list[str]:
+        return self._paths('SELECT path FROM saves WHERE NOT EXISTS (SELECT 1 FROM stories \
+WHERE stories.unit_story_id = ? AND stories.path = saves.path) ORDER BY path', (unit_story_id,))
+
+    def saves_over_crystal_cap(self, cap: int = CRYSTAL_CAP) -> list[str]:
+        return self._paths('SELECT path FROM saves WHERE crystal > ? ORDER BY path', (cap,))
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM saves').fetchone()[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Index saves into sqlite and query across them.')
+    parser.add_argument('--database', default = DEFAULT_DATABASE)
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    index_parser = commands.add_parser('index', help = 'add or refresh every save in a directory')
+    index_parser.add_argument('directory')
+    index_parser.add_argument('--pattern', default = batch_processing.DEFAULT_PATTERN)
+    index_parser.add_argument('--workers', type = int, default = None)
+    index_parser.add_argument('--prune', action = 'store_true',
+                              help = 'remove indexed saves from this directory and pattern that no longer exist')
+
+    missing_parser = commands.add_parser('missing', help = 'list saves without an adventurer')
+    missing_parser.add_argument('chara_id', type = int)
+
+    over_cap_parser = commands.add_parser('over-cap', help = 'list saves with more wyrmite than the cap')
+    over_cap_parser.add_argument('--cap', type = int, default = CRYSTAL_CAP)
+
+    query_parser = commands.add_parser('query', help = 'run a read-only sql query')
+    query_parser.add_argument('sql')
+    args = parser.parse_args()
+
+    with FleetIndex(args.database) as fleet:
+        if args.command == 'index':
+            report = fleet.index(batch_processing.find_saves(args.directory, args.pattern),
+                                 args.workers, args.directory if args.prune else None, args.pattern)
+            report.print_summary()
+        elif args.command == 'missing':
+            for path in fleet.saves_missing_character(args.chara_id):
+                print(path)
+        elif args.command == 'over-cap':
+            for path in fleet.saves_over_crystal_cap(args.cap):
+                print(path)
+        else:
+            for row in fleet.query(args.sql):
+                print('\t'.join(str(value) for value in row))
@@ -0,0 +1,222 @@
+# instrumentation.py
+#
+# named timing spans and counters around save loading, editing and writing.
+# everything is off unless sinks are configured, either through the
+# DRAGALIA_INSTRUMENT environment variable or the editor's --instrument flag,
+# using a comma separated list such as:
+#
+#   log,json=metrics.json,cprofile=profile.out,tracemalloc=allocations.txt
+#
+# a {pid} in a file name is replaced by the process id, so that batch
+# workers do not overwrite each other's files.
+
+import atexit
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+ENV_VAR = 'DRAGALIA_INSTRUMENT'
+
+class InstrumentationConfigError(Exception):
+    pass
+
+_enabled = False
+_sinks = []
+_counters = dict()
+# spans and counters are recorded from executor and server threads. only
+# taken while instrumentation is on, so the disabled path stays one check
+_lock = threading.Lock()
+
+class _NullSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, name: str):
+        self._name = name
+        self._start = None
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type: type, exc_value: Exception, traceback: 'Traceback') -> bool:
+        seconds = time.perf_counter() - self._start
+        with _lock:
+            for sink in _sinks:
+                sink.record_span(self._name, seconds, exc_type != None)
+        return False
+
+def span(name: str) -> _Span | _NullSpan:
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+def instrumented(name: str) -> 'Function':
+    def decorator(func: 'Function') -> 'Function':
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str, amount: int = 1) -> None:
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+def is_enabled() -> bool:
+    return _enabled
+
+def get_counters() -> dict:
+    with _lock:
+        return _counters.copy()
+
+def _file_name(path: str) -> str:
+    return path.replace('{pid}', str(os.getpid()))
+
+class LogSink:
+    def __init__(self):
+        self._logger = logging.getLogger('dragalia.instrumentation')
+        if not self._logger.handlers:
+            self._logger.addHandler(logging.StreamHandler())
+        self._logger.setLevel(logging.INFO)
+
+    def record_span(self, name: str, seconds: float, failed: bool) -> None:
+        status = ' (failed)' if failed else ''
+        self._logger.info(f'{name}: {seconds * 1000:.3f} ms{status}')
+
+    def flush(self, counters: dict) -> None:
+        if counters:
+            self._logger.info('counters: ' + ', '.join(f'{name}={value}'
+                                                       for name, value in sorted(counters.items())))
+
+    def close(self, counters: dict) -> None:
+        self.flush(counters)
+
+class JsonMetricsSink:
+    def __init__(self, path: str):
+        self._path = path
+        self._spans = dict()
+
+    def record_span(self, name: str, seconds: float, failed: bool) -> None:
+        if name not in self._spans:
+            self._spans[name] = {'count': 0, 'failed': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+        stats = self._spans[name]
+        stats['count'] += 1
+        stats['failed'] += 1 if failed else 0
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def flush(self, counters: dict) -> None:
+        with open(_file_name(self._path), 'w') as file:
+            json.dump({'spans': self._spans, 'counters': counters}, file, indent = 2)
+
+    def close(self, counters: dict) -> None:
+        self.flush(counters)
+
+class ProfileSink:
+    def __init__(self, path: str):
+        self._path = path
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def record_span(self, name: str, seconds: float, failed: bool) -> None:
+        pass
+
+    def flush(self, counters: dict) -> None:
+        self._profile.dump_stats(_file_name(self._path))
+
+    def close(self, counters: dict) -> None:
+        self._profile.disable()
+        self.flush(counters)
+
+class TracemallocSink:
+    def __init__(self, path: str, limit: int = 25):
+        self._path = path
+        self._limit = limit
+        tracemalloc.start()
+
+    def record_span(self, name: str, seconds: float, failed: bool) -> None:
+        pass
+
+    def flush(self, counters: dict) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+
+        with open(_file_name(self._path), 'w') as file:
+            file.write(f'current: {current} bytes, peak: {peak} bytes\n')
+            for stat in statistics[:self._limit]:
+                file.write(f'{stat}\n')
+
+    def close(self, counters: dict) -> None:
+        self.flush(counters)
+        tracemalloc.stop()
+
+def _create_sink(entry: str) -> object:
+    name, _, path = entry.partition('=')
+    name = name.strip().lower()
+    path = path.strip()
+
+    if name not in ('log', 'json', 'cprofile', 'tracemalloc'):
+        raise InstrumentationConfigError(f'Unknown instrumentation sink: {name}')
+    if name == 'log':
+        return LogSink()
+    if path == '':
+        raise InstrumentationConfigError(f'{name} needs a file name, e.g. {name}=output')
+    if name == 'json':
+        return JsonMetricsSink(path)
+    if name == 'cprofile':
+        return ProfileSink(path)
+    return TracemallocSink(path)
+
+def configure(spec: str) -> None:
+    global _enabled
+    shutdown()
+
+    for entry in spec.split(','):
+        if entry.strip() == '':
+            continue
+        try:
+            _sinks.append(_create_sink(entry))
+        except InstrumentationConfigError:
+            shutdown()
+            raise
+
+    _enabled = len(_sinks) != 0
+
+def flush() -> None:
+    with _lock:
+        for sink in _sinks:
+            sink.flush(_counters.copy())
+
+def shutdown() -> None:
+    global _enabled
+    _enabled = False
+    with _lock:
+        for sink in _sinks:
+            sink.close(_counters.copy())
+        _sinks.clear()
+        _counters.clear()
+
+atexit.register(shutdown)
+
+if os.environ.get(ENV_VAR, '').strip() != '':
+    # a bad setting must not stop every program that imports this module
+    try:
+        configure(os.environ[ENV_VAR])
+    except InstrumentationConfigError as error:
+        print(f'Warning: ignoring {ENV_VAR}, instrumentation is off. {error}', file = sys.stderr)
@@ -1,8 +1,21 @@
 # json_handling.py
 
+from contextlib import contextmanager
+import functools
+import hashlib
 import json
+import os
 import time
 import math
+import file_handling
+import instrumentation
+
+try:
+    import fcntl
+except ImportError:
+    # advisory locking is only available on unix, elsewhere the staleness
+    # check on write is the only protection against concurrent writers
+    fcntl = None
 
 class FileConversionError(Exception):
     pass
@@ -25,6 +38,48 @@ class EncyclopediaBonusesNotFoundError(Exception):
 class UnitStoryListNotFoundError(Exception):
     pass
 
+class StaleSaveFileError(Exception):
+    pass
+
+class CheckpointTrimmedError(Exception):
+    pass
+
+HISTORY_LIMIT = 100
+
+# stands in for a dict key that did not exist before an edit
+_MISSING = object()
+
+def _records_history(func: 'Function') -> 'Function':
+    # everything a public edit changes becomes one undo step
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._edit_step():
+            return func(self, *args, **kwargs)
+    return wrapper
+
+def _apply_change(change: tuple) -> tuple:
+    # applies a recorded change and returns the change that reverses it.
+    # only references are stored, so a step costs memory proportional to
+    # what it touched rather than to the save
+    kind, container = change[0], change[1]
+
+    if kind == 'set':
+        key, value = change[2], change[3]
+        try:
+            current = container[key]
+        except KeyError:
+            current = _MISSING
+        if value is _MISSING:
+            del container[key]
+        else:
+            container[key] = value
+        return ('set', container, key, current)
+    if kind == 'append':
+        container.append(change[2])
+        return ('pop', container)
+
+    return ('append', container, container.pop())
+
 def _is_int(string: str) -> bool:
     try:
         int(string)
@@ -32,13 +87,140 @@ def _is_int(string: str) -> bool:
     except ValueError:
         return False
 
+@instrumentation.instrumented('load.resource')
+def _load_resource(path: str) -> dict:
+    file = open(path)
+    try:
+        return json.load(file)
+    except:
+        raise ResourceConversionError
+    finally:
+        file.close()
+
+def build_max_character(char_id: int, all_character_data: dict,
+                        has_spiral: bool = False, shared_skill_cost: int = 0,
+                        max_hp: int = 0, max_atk: int = 0,
+                        gettime: int = None) -> 'Character':
+    # a character record at max stats. characters in all_character_data
+    # take their stats from it, the arguments are only used for others
+    if str(char_id) in all_character_data:
+        char_data = all_character_data[str(char_id)].copy()
+        has_spiral = 'ManaSpiralDate' in char_data
+        shared_skill_cost = char_data['EditSkillCost']
+        
+        if has_spiral:
+            max_hp = char_data['AddMaxHp1'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['PlusHp5'] + char_data['McFullBonusHp5']
+            max_atk = char_data['AddMaxAtk1'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['PlusAtk5'] + char_data['McFullBonusAtk5']
+        else:
+            max_hp = char_data['MaxHp'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['McFullBonusHp5']
+            max_atk = char_data['MaxAtk'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['McFullBonusAtk5']
+
+    mc_list = []
+    mc_level = 70 if has_spiral else 50
+
+    for i in range(1, mc_level + 1):
+        mc_list.append(i)
+
+    new_char = dict()
+    new_char['chara_id'] = char_id
+    new_char['rarity'] = 5
+    new_char['exp'] = 8866950 if has_spiral else 1191950
+    new_char['level'] = 100 if has_spiral else 80
+    new_char['additional_max_level'] = 20 if has_spiral else 0
+    new_char['hp_plus_count'] = 100
+    new_char['attack_plus_count'] = 100
+    new_char['limit_break_count'] = 5 if has_spiral else 4
+    new_char['is_new'] = 1
+    new_char['gettime'] = gettime if gettime != None else int(time.time())
+    new_char['skill_1_level'] = 4 if has_spiral else 3
+    new_char['skill_2_level'] = 3 if has_spiral else 2
+    new_char['ability_1_level'] = 3 if has_spiral else 2
+    new_char['ability_2_level'] = 3 if has_spiral else 2
+    new_char['ability_3_level'] = 2
+    new_char['burst_attack_level'] = 2
+    new_char['combo_buildup_count'] = 1 if has_spiral else 0
+    new_char['hp'] = max_hp
+    new_char['attack'] = max_atk
+    new_char['ex_ability_level'] = 5
+    new_char['ex_ability_2_level'] = 5
+    new_char['is_temporary'] = 0
+    new_char['is_unlock_edit_skill'] = shared_skill_cost
+    new_char['mana_circle_piece_id_list'] = mc_list
+    new_char['list_view_flag'] = 1
+
+    return new_char
+
+# attribute name -> file
+REFERENCE_FILES = {
+    'all_character_data': 'data/adventurers.txt',
+    'all_character_names': 'data/adventurer_aliases.txt',
+    'epithet_data': 'data/epithets.txt',
+    'story_data': 'data/stories.txt'}
+
+def _index_stories(story_data: dict) -> dict:
+    return {int(char_id): [int(story) for story in stories]
+            for char_id, stories in story_data.items()}
+
+class ReferenceData:
+    # the game data shared by every save, loaded once and reused so that
+    # opening many saves does not re-read the data folder each time. with
+    # lazy on, each file is only read the first time it is used
+    def __init__(self, lazy: bool = False):
+        self._resources = dict()
+        if not lazy:
+            self.preload()
+
+    def _get(self, name: str) -> dict:
+        if name not in self._resources:
+            self._resources[name] = _load_resource(REFERENCE_FILES[name])
+        return self._resources[name]
+
+    def preload(self) -> None:
+        for name in REFERENCE_FILES:
+            self._get(name)
+        self.story_ids_by_character
+
+    @property
+    def story_ids_by_character(self) -> dict:
+        # derived from story_data, built once and shared by every save
+        if 'story_ids_by_character' not in self._resources:
+            self._resources['story_ids_by_character'] = _index_stories(self.story_data)
+        return self._resources['story_ids_by_character']
+
+    all_character_data = property(lambda self: self._get('all_character_data'))
+    all_character_names = property(lambda self: self._get('all_character_names'))
+    epithet_data = property(lambda self: self._get('epithet_data'))
+    story_data = property(lambda self: self._get('story_data'))
+
 class DragaliaSaveFile:
-    def __init__(self, file_path: 'File path'):
+    @instrumentation.instrumented('load')
+    def __init__(self, file_path: 'File path',
+                 reference_data: ReferenceData = None,
+                 auto_update: bool = True, contents: bytes = None):
+        # with contents given the save lives only in memory, file_path is
+        # just its name and writes replace contents instead of a file
         self._file = file_path
+        self._contents = contents
+        self._in_memory = contents != None
+        self._auto_update = auto_update
+        self._has_changes = False
+        self._file_stat = None
+        self._file_hash = None
+        self._compression = None
+        self._lock_file = None
+        self._lock_depth = 0
+        self._undo_steps = []
+        # undo steps dropped from the front of the history, so checkpoints
+        # keep counting up once the history is full
+        self._trimmed_steps = 0
+        self._redo_steps = []
+        self._current_step = None
+        self._step_depth = 0
         self.all_character_data = None
         self.all_character_names = None
         self.epithet_data = None
         self.story_data = None
+        self._story_ids_by_character = None
         
         self._data = None
         self._user_data = None
@@ -47,11 +229,11 @@ class DragaliaSaveFile:
         self._adv_encyclo = None
         self._dragon_encyclo = None
         self._stories = None
+        self._story_index = None
 
-        self._initialize_all_character_data()
-        self._initialize_all_character_names()
-        self._initialize_epithet_data()
-        self._initialize_story_data()
+        if reference_data == None:
+            reference_data = ReferenceData()
+        self._initialize_from_reference_data(reference_data)
         
         self._initialize_data()
         self._initialize_user_data()
@@ -60,51 +242,118 @@ class DragaliaSaveFile:
         self._initialize_encyclo_bonuses()
         self._initialize_stories()
 
-    def _initialize_all_character_data(self) -> None:
-        file = open('data/adventurers.txt')
-        try:
-            self.all_character_data = json.load(file)
-        except:
-            raise ResourceConversionError
-        finally:
-            file.close()
+    def _initialize_from_reference_data(self, reference_data: ReferenceData) -> None:
+        self.all_character_data = reference_data.all_character_data
+        self.all_character_names = reference_data.all_character_names
+        self.epithet_data = reference_data.epithet_data
+        self.story_data = reference_data.story_data
+        self._story_ids_by_character = reference_data.story_ids_by_character
 
-    def _initialize_all_character_names(self) -> None:
-        file = open('data/adventurer_aliases.txt')
-        try:
-            self.all_character_names = json.load(file)
-        except:
-            raise ResourceConversionError
-        finally:
-            file.close()
+    def set_reference_data(self, reference_data: ReferenceData) -> None:
+        # switches to a newer snapshot of the game data between edits,
+        # never call this while an edit on this save is running
+        self._initialize_from_reference_data(reference_data)
+
+    @classmethod
+    def from_bytes(cls, name: str, contents: bytes,
+                   reference_data: ReferenceData = None) -> 'DragaliaSaveFile':
+        return cls(name, reference_data, auto_update = False, contents = contents)
 
-    def _initialize_epithet_data(self) -> None:
-        file = open('data/epithets.txt')
+    def to_bytes(self) -> bytes:
+        # the save as it would be written now, in its original compression
+        return self._encode()
+
+    @instrumentation.instrumented('load.parse')
+    def _initialize_data(self) -> None:
+        if self._in_memory:
+            try:
+                self._compression = file_handling.detect_compression(self._contents)
+                self._data = json.loads(file_handling.decompress(self._contents, self._compression))
+            except:
+                raise FileConversionError
+            return
+
+        with self.lock(shared = True):
+            file = open(self._file, 'rb')
+            try:
+                raw = file.read()
+                self._remember_file_state(os.fstat(file.fileno()), raw)
+                # compressed saves are written back with the same compression
+                self._compression = file_handling.detect_compression(raw)
+                self._data = json.loads(file_handling.decompress(raw, self._compression))
+            except:
+                raise FileConversionError
+            finally:
+                file.close()
+
+    def _remember_file_state(self, stat: os.stat_result, raw: bytes) -> None:
+        self._file_stat = (stat.st_mtime_ns, stat.st_size)
+        self._file_hash = hashlib.sha256(raw).hexdigest()
+
+    @contextmanager
+    def lock(self, shared: bool = False) -> None:
+        # holds an advisory lock on the save for a whole load-modify-write.
+        # nested calls reuse the lock that is already held
+        if self._lock_depth == 0 and fcntl != None and not self._in_memory:
+            self._lock_file = open(self._file, 'rb')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            except:
+                self._lock_file.close()
+                self._lock_file = None
+                raise
+
+        self._lock_depth += 1
         try:
-            self.epithet_data = json.load(file)
-        except:
-            raise ResourceConversionError
+            yield
         finally:
-            file.close()
+            self._lock_depth -= 1
+            if self._lock_depth == 0 and self._lock_file != None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+
+    def is_stale(self) -> bool:
+        # cheap stat comparison first, the file is only hashed when its
+        # mtime or size moved (e.g. touched without its contents changing)
+        if self._in_memory:
+            return False
 
-    def _initialize_story_data(self) -> None:
-        file = open('data/stories.txt')
         try:
-            self.story_data = json.load(file)
-        except:
-            raise ResourceConversionError
-        finally:
-            file.close()
+            stat = os.stat(self._file)
+        except OSError:
+            return True
 
-    def _initialize_data(self) -> None:
-        file = open(self._file)
+        if (stat.st_mtime_ns, stat.st_size) == self._file_stat:
+            return False
+
+        file = open(self._file, 'rb')
         try:
-            self._data = json.load(file)
-        except:
-            raise FileConversionError
+            raw = file.read()
         finally:
             file.close()
 
+        if hashlib.sha256(raw).hexdigest() != self._file_hash:
+            return True
+
+        self._file_stat = (stat.st_mtime_ns, stat.st_size)
+        return False
+
+    @instrumentation.instrumented('reload')
+    def reload(self) -> None:
+        self._initialize_data()
+        self._initialize_user_data()
+        self._initialize_summon_tickets()
+        self._initialize_character_data()
+        self._initialize_encyclo_bonuses()
+        self._initialize_stories()
+        self._story_index = None
+        # checkpoints taken before the reload can no longer be rolled back to
+        self._trimmed_steps += len(self._undo_steps)
+        self._undo_steps = []
+        self._redo_steps = []
+        self._has_changes = False
+
     def _initialize_user_data(self) -> None:
         try:
             self._user_data = self._data['data']['user_data']
@@ -133,16 +382,98 @@ class DragaliaSaveFile:
         except:
             raise UnitStoryListNotFoundError
 
+    @contextmanager
+    def _edit_step(self) -> None:
+        self._step_depth += 1
+        if self._step_depth == 1:
+            self._current_step = []
+        try:
+            yield
+        finally:
+            self._step_depth -= 1
+            if self._step_depth == 0:
+                if len(self._current_step) != 0:
+                    self._undo_steps.append(self._current_step)
+                    if len(self._undo_steps) > HISTORY_LIMIT:
+                        self._trimmed_steps += len(self._undo_steps) - HISTORY_LIMIT
+                        del self._undo_steps[:-HISTORY_LIMIT]
+                    self._redo_steps = []
+                self._current_step = None
+
+    def _set(self, container: dict | list, key: str | int, value: object) -> None:
+        try:
+            old_value = container[key]
+        except KeyError:
+            old_value = _MISSING
+        container[key] = value
+        if self._current_step != None:
+            self._current_step.append(('set', container, key, old_value))
+
+    def _append(self, container: list, value: object) -> None:
+        container.append(value)
+        if self._current_step != None:
+            self._current_step.append(('pop', container))
+
+    def _apply_step(self, step: list) -> list:
+        reverse_step = [_apply_change(change) for change in reversed(step)]
+        # the story index no longer matches, rebuild it on next use. the
+        # story list itself may have been swapped back
+        self._initialize_stories()
+        self._story_index = None
+        return reverse_step
+
+    def can_undo(self) -> bool:
+        return len(self._undo_steps) != 0
+
+    def can_redo(self) -> bool:
+        return len(self._redo_steps) != 0
+
+    def undo(self) -> bool:
+        if not self.can_undo():
+            return False
+        self._redo_steps.append(self._apply_step(self._undo_steps.pop()))
+        self._update()
+        return True
+
+    def redo(self) -> bool:
+        if not self.can_redo():
+            return False
+        self._undo_steps.append(self._apply_step(self._redo_steps.pop()))
+        self._update()
+        return True
+
+    def checkpoint(self) -> int:
+        return self._trimmed_steps + len(self._undo_steps)
+
+    def rollback(self, checkpoint: int) -> int:
+        # undoes every edit made since checkpoint() without re-reading the file
+        if checkpoint < self._trimmed_steps:
+            raise CheckpointTrimmedError
+
+        count = 0
+        while self._trimmed_steps + len(self._undo_steps) > checkpoint:
+            self._apply_step(self._undo_steps.pop())
+            count += 1
+
+        self._redo_steps = []
+        if count != 0:
+            self._update()
+        return count
+
     def get_user_data(self) -> dict:
         return self._user_data.copy()
 
     def get_character_data(self) -> list:
         return self._character_data[:]
 
+    @instrumentation.instrumented('modify_user_data')
+    @_records_history
     def modify_user_data(self, field: str, new_value: int | str) -> None:
-        self._user_data[field] = new_value
+        self._set(self._user_data, field, new_value)
         self._update()
 
+    @instrumentation.instrumented('add_char')
+    @_records_history
     def add_char(self, char_id: int, has_spiral: bool = False,
                  shared_skill_cost: int = 0, max_hp: int = 0, max_atk: int = 0,
                  stories: list[int] = None, gettime: int = None,
@@ -160,7 +491,7 @@ class DragaliaSaveFile:
             og_level = self._character_data[index]['level']
             og_mc = len(self._character_data[index]['mana_circle_piece_id_list'])
 
-            self._character_data[index] = self._create_max_character(char_id, gettime = gettime)
+            self._set(self._character_data, index, self._create_max_character(char_id, gettime = gettime))
 
             element = int(str(char_id)[5])
             has_spiral = self._character_data[i]['level'] == 100
@@ -183,9 +514,10 @@ class DragaliaSaveFile:
                     else:
                         self._add_adv_encyclo_bonus(element, atk = 0.1)
             
+            instrumentation.count('characters_maxed')
             output = False
         else:
-            self._character_data.append(self._create_max_character(char_id, has_spiral, shared_skill_cost, max_hp, max_atk, stories, gettime))
+            self._append(self._character_data, self._create_max_character(char_id, has_spiral, shared_skill_cost, max_hp, max_atk, stories, gettime))
             element = int(str(char_id)[5])
             has_spiral = self._character_data[-1]['level'] == 100
 
@@ -194,6 +526,7 @@ class DragaliaSaveFile:
             else:
                 self._add_adv_encyclo_bonus(element, 0.2, 0.2)
 
+            instrumentation.count('characters_added')
             output = True
             
         if not group:
@@ -201,6 +534,8 @@ class DragaliaSaveFile:
 
         return output
 
+    @instrumentation.instrumented('add_all_missing_chars')
+    @_records_history
     def add_all_missing_chars(self) -> int:
         current_chars = set()
         count = 0
@@ -216,6 +551,8 @@ class DragaliaSaveFile:
         self._update()
         return count
 
+    @instrumentation.instrumented('max_all_current_chars')
+    @_records_history
     def max_all_current_chars(self) -> None:
         for i in range(len(self._character_data)):
             char_id = self._character_data[i]['chara_id']
@@ -226,6 +563,8 @@ class DragaliaSaveFile:
 
         self._update()
 
+    @instrumentation.instrumented('max_out_character_list')
+    @_records_history
     def max_out_character_list(self) -> None:
         self.max_all_current_chars()
         self.add_all_missing_chars()
@@ -234,51 +573,8 @@ class DragaliaSaveFile:
                               shared_skill_cost: int = 0, max_hp: int = 0,
                               max_atk: int = 0, stories: list[int] = None,
                               gettime: int = None) -> 'Character':
-        if str(char_id) in self.all_character_data:
-            char_data = self.all_character_data[str(char_id)].copy()
-            has_spiral = 'ManaSpiralDate' in char_data
-            shared_skill_cost = char_data['EditSkillCost']
-            
-            if has_spiral:
-                max_hp = char_data['AddMaxHp1'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['PlusHp5'] + char_data['McFullBonusHp5']
-                max_atk = char_data['AddMaxAtk1'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['PlusAtk5'] + char_data['McFullBonusAtk5']
-            else:
-                max_hp = char_data['MaxHp'] + char_data['PlusHp0'] + char_data['PlusHp1'] + char_data['PlusHp2'] + char_data['PlusHp3'] + char_data['PlusHp4'] + char_data['McFullBonusHp5']
-                max_atk = char_data['MaxAtk'] + char_data['PlusAtk0'] + char_data['PlusAtk1'] + char_data['PlusAtk2'] + char_data['PlusAtk3'] + char_data['PlusAtk4'] + char_data['McFullBonusAtk5']
-
-        mc_list = []
-        mc_level = 70 if has_spiral else 50
-
-        for i in range(1, mc_level + 1):
-            mc_list.append(i)
-
-        new_char = dict()
-        new_char['chara_id'] = char_id
-        new_char['rarity'] = 5
-        new_char['exp'] = 8866950 if has_spiral else 1191950
-        new_char['level'] = 100 if has_spiral else 80
-        new_char['additional_max_level'] = 20 if has_spiral else 0
-        new_char['hp_plus_count'] = 100
-        new_char['attack_plus_count'] = 100
-        new_char['limit_break_count'] = 5 if has_spiral else 4
-        new_char['is_new'] = 1
-        new_char['gettime'] = gettime if gettime != None else int(time.time())
-        new_char['skill_1_level'] = 4 if has_spiral else 3
-        new_char['skill_2_level'] = 3 if has_spiral else 2
-        new_char['ability_1_level'] = 3 if has_spiral else 2
-        new_char['ability_2_level'] = 3 if has_spiral else 2
-        new_char['ability_3_level'] = 2
-        new_char['burst_attack_level'] = 2
-        new_char['combo_buildup_count'] = 1 if has_spiral else 0
-        new_char['hp'] = max_hp
-        new_char['attack'] = max_atk
-        new_char['ex_ability_level'] = 5
-        new_char['ex_ability_2_level'] = 5
-        new_char['is_temporary'] = 0
-        new_char['is_unlock_edit_skill'] = shared_skill_cost
-        new_char['mana_circle_piece_id_list'] = mc_list
-        new_char['list_view_flag'] = 1
-
+        new_char = build_max_character(char_id, self.all_character_data, has_spiral,
+                                       shared_skill_cost, max_hp, max_atk, gettime)
         self._add_stories(char_id, stories)
         
         return new_char
@@ -286,39 +582,152 @@ class DragaliaSaveFile:
     def _add_adv_encyclo_bonus(self, elem: int, hp: float = 0,
                                atk: float = 0) -> None:
         if 1 <= elem <= 5:
-            self._adv_encyclo[elem - 1]['hp'] = math.fsum(self._adv_encyclo[elem - 1]['hp'], hp)
-            self._adv_encyclo[elem - 1]['attack'] = math.fsum(self._adv_encyclo[elem - 1]['attack'], atk)
+            self._set(self._adv_encyclo[elem - 1], 'hp', math.fsum([self._adv_encyclo[elem - 1]['hp'], hp]))
+            self._set(self._adv_encyclo[elem - 1], 'attack', math.fsum([self._adv_encyclo[elem - 1]['attack'], atk]))
 
     def _add_dragon_encyclo_bonus(self, elem: int, hp: float = 0,
                                   atk: float = 0) -> None:
         if 1 <= elem <= 5: 
-            self._dragon_encyclo[elem - 1]['hp'] = math.fsum(self._dragon_encyclo[elem - 1]['hp'], hp)
-            self._dragon_encyclo[elem - 1]['attack'] = math.fsum(self._dragon_encyclo[elem - 1]['attack'], atk)
+            self._set(self._dragon_encyclo[elem - 1], 'hp', math.fsum([self._dragon_encyclo[elem - 1]['hp'], hp]))
+            self._set(self._dragon_encyclo[elem - 1], 'attack', math.fsum([self._dragon_encyclo[elem - 1]['attack'], atk]))
         
+    def _get_story_index(self) -> dict:
+        # unit_story_id -> position in unit_story_list, built on first use
+        # and kept up to date by _add_story
+        if self._story_index == None:
+            self._story_index = dict()
+            for position, story in enumerate(self._stories):
+                self._story_index.setdefault(story['unit_story_id'], position)
+        return self._story_index
+
+    @instrumentation.instrumented('add_stories')
     def _add_stories(self, char_id: int, stories: list[int] = None) -> None:
-        current_stories = set()
-
-        for story in self._stories:
-            current_stories.add(story['unit_story_id'])
+        story_index = self._get_story_index()
 
         if stories == None:
-            if str(char_id) in self.story_data:
-                for story in self.story_data[str(char_id)]:
-                    if int(story) not in current_stories:
-                        self._add_story(int(story))
-        else:
-            for story in stories:
-                if story not in current_stories:
-                    self._add_story(story)
+            stories = self._story_ids_by_character.get(char_id, [])
+
+        for story in stories:
+            if story not in story_index:
+                self._add_story(story)
 
     def _add_story(self, story_id: int, is_read: int = 0) -> None:
-        self._stories.append({'unit_story_id': story_id, 'is_read': is_read})
+        if self._story_index != None:
+            self._story_index.setdefault(story_id, len(self._stories))
+        self._append(self._stories, {'unit_story_id': story_id, 'is_read': is_read})
+        instrumentation.count('stories_appended')
+
+    def get_stories(self) -> list:
+        return self._stories[:]
+
+    def _mark_read(self, position: int) -> bool:
+        story = self._stories[position]
+        if story.get('is_read') == 1:
+            return False
+        self._set(story, 'is_read', 1)
+        return True
+
+    @instrumentation.instrumented('mark_all_stories_read')
+    @_records_history
+    def mark_all_stories_read(self) -> int:
+        count = 0
+        for position in range(len(self._stories)):
+            if self._mark_read(position):
+                count += 1
+
+        if count != 0:
+            self._update()
+        return count
+
+    @instrumentation.instrumented('mark_stories_read')
+    @_records_history
+    def mark_stories_read(self, char_ids: list[int]) -> int:
+        # only the stories the save already has are marked, none are added
+        story_index = self._get_story_index()
+        count = 0
+
+        for char_id in char_ids:
+            for story in self._story_ids_by_character.get(char_id, []):
+                if story in story_index and self._mark_read(story_index[story]):
+                    count += 1
+
+        if count != 0:
+            self._update()
+        return count
+
+    @instrumentation.instrumented('remove_orphaned_stories')
+    @_records_history
+    def remove_orphaned_stories(self) -> int:
+        # removes the stories of known characters the save does not own.
+        # stories that are not in the catalog at all (e.g. dragon stories)
+        # are always kept
+        owned = set(char['chara_id'] for char in self._character_data)
+        orphaned = set()
+        for char_id, stories in self._story_ids_by_character.items():
+            if char_id not in owned:
+                orphaned.update(stories)
+
+        kept = [story for story in self._stories if story['unit_story_id'] not in orphaned]
+        count = len(self._stories) - len(kept)
+        if count == 0:
+            return 0
+
+        # the list is replaced as a whole, so undo only has to put the old
+        # one back
+        self._set(self._data['data'], 'unit_story_list', kept)
+        self._initialize_stories()
+        self._story_index = None
+        self._update()
+        return count
+
+    def get_compression(self) -> str:
+        return self._compression
+
+    def has_unsaved_changes(self) -> bool:
+        return self._has_changes
+
+    def flush(self) -> None:
+        if self._has_changes:
+            self._write()
 
     def _update(self) -> None:
-        file = open(self._file, 'w')
+        # with auto_update off, edits stay in memory until flush() is called
+        if self._auto_update:
+            self._write()
+        else:
+            self._has_changes = True
+
+    def _encode(self) -> bytes:
         try:
-            json.dump(self._data, file, indent = 2)
+            raw = json.dumps(self._data, indent = 2).replace('\n', os.linesep).encode()
+            return file_handling.compress(raw, self._compression)
         except:
             raise FileEncodingError
-        finally:
-            file.close()
+
+    @instrumentation.instrumented('write')
+    def _write(self) -> None:
+        with self.lock():
+            # another process wrote the save after we loaded it, writing
+            # now would silently throw their changes away
+            if self.is_stale():
+                raise StaleSaveFileError
+
+            raw = self._encode()
+            if self._in_memory:
+                self._contents = raw
+                instrumentation.count('bytes_written', len(raw))
+                self._has_changes = False
+                return
+
+            file = open(self._file, 'wb')
+            try:
+                file.write(raw)
+                file.flush()
+                instrumentation.count('bytes_written', len(raw))
+                self._remember_file_state(os.fstat(file.fileno()), raw)
+            except:
+                raise FileEncodingError
+            finally:
+                file.close()
+
+        self._has_changes = False
@@ -0,0 +1,84 @@
+# reference_catalog.py
+#
+# keeps the game data of a long running process up to date. the data files
+# are polled for changes and, when one changes, a complete new ReferenceData
+# is built on the watcher thread and then swapped in as a whole. a save only
+# ever sees one snapshot, so an edit that is already running keeps working
+# against the data it started with and the next edit picks up the new one.
+
+import os
+import sys
+import threading
+import json_handling
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+def _file_state(path: str) -> tuple:
+    # a missing file is part of the state too, putting it back counts as a
+    # change
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _data_state() -> dict:
+    return {name: _file_state(path) for name, path in json_handling.REFERENCE_FILES.items()}
+
+class ReferenceCatalog:
+    def __init__(self, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self._poll_interval = poll_interval
+        self._state = _data_state()
+        self._snapshot = json_handling.ReferenceData()
+        self._version = 1
+        self._swap_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def snapshot(self) -> json_handling.ReferenceData:
+        return self._snapshot
+
+    def get_version(self) -> int:
+        return self._version
+
+    def check_for_changes(self) -> bool:
+        # returns True if a new snapshot was swapped in
+        state = _data_state()
+        if state == self._state:
+            return False
+
+        try:
+            snapshot = json_handling.ReferenceData()
+        except Exception:
+            # most likely a file that is still being written, or valid JSON
+            # of the wrong shape. the old snapshot stays in use and the next
+            # poll tries again
+            return False
+
+        with self._swap_lock:
+            self._snapshot = snapshot
+            self._state = state
+            self._version += 1
+        return True
+
+    def _watch(self) -> None:
+        # nothing may end the watcher, or hot reload would stop for good
+        while not self._stop.wait(self._poll_interval):
+            try:
+                self.check_for_changes()
+            except Exception as error:
+                print(f'Warning: reference data check failed, keeping the current data. {type(error).__name__}: {error}',
+                      file = sys.stderr)
+
+    def start_watching(self) -> None:
+        if self._watcher != None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target = self._watch, name = 'reference-catalog', daemon = True)
+        self._watcher.start()
+
+    def stop_watching(self) -> None:
+        self._stop.set()
+        if self._watcher != None:
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,266 @@
+# roster_export.py
+#
+# exports the profile and roster of many saves as tables, one row per account
+# and one row per owned character, for analysis outside the editor. saves are
+# read by a pool of workers through SaveView, so only user_data and chara_list
+# are parsed, and rows are written out in batches as results come in. memory
+# use depends on the batch size, not on how many saves or rows there are.
+#
+# csv is always available. parquet and arrow (feather) need pyarrow.
+
+from pathlib import Path
+import argparse
+import csv
+import os
+import time
+import batch_processing
+import dragalia_save_editor_interface
+import json_handling
+import save_view
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('csv', 'parquet', 'arrow')
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+DEFAULT_BATCH_SIZE = 10000
+
+# column name -> column type, in output order
+ACCOUNT_COLUMNS = {
+    'path': 'str',
+    'viewer_id': 'int',
+    'name': 'str',
+    'emblem_id': 'int',
+    'epithet': 'str',
+    'level': 'int',
+    'crystal': 'int',
+    'coin': 'int',
+    'mana_point': 'int',
+    'dew_point': 'int',
+    'character_count': 'int'}
+
+CHARACTER_COLUMNS = {
+    'path': 'str',
+    'viewer_id': 'int',
+    'chara_id': 'int',
+    'name': 'str',
+    'rarity': 'str',
+    'element': 'str',
+    'weapon': 'str',
+    'level': 'int',
+    'mana_circle': 'int',
+    'augments': 'int',
+    'gettime': 'int'}
+
+class ExportUnavailableError(Exception):
+    pass
+
+def account_row(path: str, user_data: dict, characters: list, epithets: dict) -> dict:
+    return {
+        'path': path,
+        'viewer_id': user_data.get('viewer_id'),
+        'name': user_data.get('name'),
+        'emblem_id': user_data.get('emblem_id'),
+        'epithet': epithets.get(str(user_data.get('emblem_id'))),
+        'level': user_data.get('level', 0),
+        'crystal': user_data.get('crystal', 0),
+        'coin': user_data.get('coin', 0),
+        'mana_point': user_data.get('mana_point', 0),
+        'dew_point': user_data.get('dew_point', 0),
+        'character_count': len(characters)}
+
+def character_rows(path: str, user_data: dict, characters: list, all_character_data: dict) -> list[dict]:
+    rows = []
+    for char in characters:
+        row = dragalia_save_editor_interface.summarize_character(char, all_character_data)
+        row['path'] = path
+        row['viewer_id'] = user_data.get('viewer_id')
+        rows.append(row)
+    return rows
+
+class CsvTableWriter:
+    def __init__(self, path: str | Path, columns: dict):
+        self._file = open(path, 'w', newline = '')
+        self._writer = csv.DictWriter(self._file, fieldnames = list(columns), extrasaction = 'ignore')
+        self._writer.writeheader()
+
+    def write_batch(self, rows: list[dict]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+def _arrow_schema(columns: dict) -> 'Schema':
+    types = {'int': pyarrow.int64(), 'str': pyarrow.string()}
+    return pyarrow.schema([(name, types[kind]) for name, kind in columns.items()])
+
+class ArrowTableWriter:
+    # writes each batch as its own record batch / row group, so nothing but
+    # the current batch is held in memory
+    def __init__(self, path: str | Path, columns: dict, parquet: bool):
+        if pyarrow == None:
+            raise ExportUnavailableError('Parquet and Arrow output need pyarrow, install it with pip install pyarrow')
+        self._columns = list(columns)
+        self._schema = _arrow_schema(columns)
+        if parquet:
+            self._writer = pyarrow.parquet.ParquetWriter(str(path), self._schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(str(path), self._schema)
+
+    def write_batch(self, rows: list[dict]) -> None:
+        table = pyarrow.Table.from_pylist([{name: row.get(name) for name in self._columns} for row in rows],
+                                          schema = self._schema)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        self._writer.close()
+
+def create_writer(path: str | Path, columns: dict, output_format: str) -> object:
+    if output_format not in FORMATS:
+        raise ValueError(f'Unknown export format: {output_format}')
+    if output_format == 'csv':
+        return CsvTableWriter(path, columns)
+    return ArrowTableWriter(path, columns, output_format == 'parquet')
+
+class _Table:
+    # buffers rows for every output format of one table and hands them to
+    # the writers once a batch is full
+    def __init__(self, name: str, columns: dict, output_directory: Path,
+                 formats: list[str], batch_size: int):
+        self._batch_size = batch_size
+        self._rows = []
+        self._writers = []
+        self.row_count = 0
+        try:
+            for output_format in formats:
+                path = output_directory / (name + EXTENSIONS[output_format])
+                self._writers.append(create_writer(path, columns, output_format))
+        except:
+            self.close()
+            raise
+
+    def add(self, rows: list[dict]) -> None:
+        self._rows.extend(rows)
+        self.row_count += len(rows)
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._rows) != 0:
+            for writer in self._writers:
+                writer.write_batch(self._rows)
+            self._rows = []
+
+    def close(self) -> None:
+        for writer in self._writers:
+            writer.close()
+
+# set once per worker by _initialize_worker, see batch_processing
+_reference_data = None
+
+def _initialize_worker(reference_data: json_handling.ReferenceData) -> None:
+    global _reference_data
+    _reference_data = reference_data
+
+def _export_save(path: str) -> dict:
+    result = {'path': path, 'account': None, 'characters': None, 'error': None}
+    try:
+        with save_view.SaveView(path, _reference_data) as view:
+            user_data = view.get_user_data()
+            characters = dragalia_save_editor_interface.sort_characters(view.get_character_data())
+
+        result['account'] = account_row(path, user_data, characters, _reference_data.epithet_data)
+        result['characters'] = character_rows(path, user_data, characters,
+                                              _reference_data.all_character_data)
+    except Exception as error:
+        if str(error) == '':
+            result['error'] = type(error).__name__
+        else:
+            result['error'] = f'{type(error).__name__}: {error}'
+    return result
+
+class ExportReport:
+    def __init__(self):
+        self.accounts = 0
+        self.characters = 0
+        self.failed = []
+        self.elapsed = 0.0
+
+    def print_summary(self) -> None:
+        print(f'Exported {self.accounts} accounts and {self.characters} characters in {self.elapsed:.2f}s.')
+        for path, error in sorted(self.failed):
+            print(f'  FAILED {path}: {error}')
+
+def run_export(paths: list[str], output_directory: str | Path, formats: list[str] = ('csv',),
+               workers: int = None, batch_size: int = DEFAULT_BATCH_SIZE,
+               reference_data: json_handling.ReferenceData = None) -> ExportReport:
+    for output_format in formats:
+        if output_format not in FORMATS:
+            raise ValueError(f'Unknown export format: {output_format}')
+    if reference_data == None:
+        reference_data = json_handling.ReferenceData()
+    if workers == None:
+        workers = os.cpu_count() or 1
+
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents = True, exist_ok = True)
+    report = ExportReport()
+    start = time.perf_counter()
+
+    accounts = _Table('accounts', ACCOUNT_COLUMNS, output_directory, formats, batch_size)
+    try:
+        characters = _Table('characters', CHARACTER_COLUMNS, output_directory, formats, batch_size)
+    except:
+        accounts.close()
+        raise
+
+    try:
+        context = batch_processing._get_context()
+        workers = max(1, min(workers, len(paths)))
+
+        # results arrive in completion order and are written straight away,
+        # the pool never holds more than the saves currently being read
+        with context.Pool(workers, _initialize_worker, (reference_data,)) as pool:
+            for result in pool.imap_unordered(_export_save, paths, chunksize = 4):
+                if result['error'] != None:
+                    report.failed.append((result['path'], result['error']))
+                    continue
+                accounts.add([result['account']])
+                characters.add(result['characters'])
+
+        accounts.flush()
+        characters.flush()
+    finally:
+        accounts.close()
+        characters.close()
+
+    report.accounts = accounts.row_count
+    report.characters = characters.row_count
+    report.elapsed = time.perf_counter() - start
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Export the profiles and rosters of many saves as tables.')
+    parser.add_argument('directory')
+    parser.add_argument('output')
+    parser.add_argument('--pattern', default = batch_processing.DEFAULT_PATTERN)
+    parser.add_argument('--format', action = 'append', choices = FORMATS, dest = 'formats',
+                        help = 'output format, can be given more than once (default: csv)')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--batch-size', type = int, default = DEFAULT_BATCH_SIZE,
+                        help = 'rows buffered per table before they are written out')
+    args = parser.parse_args()
+
+    paths = batch_processing.find_saves(args.directory, args.pattern)
+    if len(paths) == 0:
+        print(f'No saves matching {args.pattern} found in {args.directory}.')
+    else:
+        try:
+            report = run_export(paths, args.output, args.formats or ['csv'], args.workers, args.batch_size)
+            report.print_summary()
+        except ExportUnavailableError as error:
+            print(error)
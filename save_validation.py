@@ -0,0 +1,284 @@
+# save_validation.py
+#
+# checks that a file has the layout of a Dragalia save without building the
+# whole document. the file is scanned front to back once, tracking only the
+# object keys on the way down, and the scan stops as soon as every required
+# section has been seen. every problem found is reported with its byte offset.
+#
+# the same scan is used by locate_sections() to find where a section's value
+# starts and ends, so it can be parsed on its own.
+
+import mmap
+import re
+import file_handling
+
+# required key paths and the json type their value must have
+REQUIRED_SECTIONS = {
+    ('data',): 'object',
+    ('data', 'user_data'): 'object',
+    ('data', 'chara_list'): 'array',
+    ('data', 'fort_bonus_list'): 'object',
+    ('data', 'fort_bonus_list', 'chara_bonus_by_album'): 'array',
+    ('data', 'fort_bonus_list', 'dragon_bonus_by_album'): 'array',
+    ('data', 'unit_story_list'): 'array'}
+
+_TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]:,]|[^\s{}\[\]:,"]+')
+# only what matters for bracket matching, used to skip untracked containers
+_STRUCTURE = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+_TYPES = {ord('{'): 'object', ord('['): 'array', ord('"'): 'string'}
+_HEAD_SIZE = 4096
+
+class NotASaveFileError(Exception):
+    pass
+
+class StructureProblem:
+    def __init__(self, offset: int, message: str):
+        self.offset = offset
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f'StructureProblem({self.offset}, {self.message!r})'
+
+    def __str__(self) -> str:
+        return f'byte {self.offset}: {self.message}'
+
+def _format_path(path: tuple) -> str:
+    return '.'.join(path)
+
+def _value_type(token: bytes) -> str:
+    if token[0] in _TYPES:
+        return _TYPES[token[0]]
+    return 'scalar'
+
+class _Scanner:
+    def __init__(self, buffer: bytes, sections: dict, want_spans: bool = False):
+        self._buffer = buffer
+        self._sections = sections
+        self._want_spans = want_spans
+        self.spans = dict()
+        # the deepest required path decides how far down keys are tracked
+        self._max_depth = max(len(path) for path in sections)
+        self.problems = []
+        self.found = dict()
+        # where each tracked object starts, missing keys are reported there
+        self.offsets = dict()
+        self.completed = False
+
+    def _problem(self, offset: int, message: str) -> None:
+        self.problems.append(StructureProblem(offset, message))
+
+    def _check_head(self) -> bool:
+        head = self._buffer[:_HEAD_SIZE]
+        if b'\0' in head:
+            self._problem(head.index(b'\0'), 'binary data, not a JSON text file')
+            return False
+
+        stripped = head.lstrip()
+        if len(stripped) == 0:
+            self._problem(0, 'file is empty')
+            return False
+        if stripped[:1] != b'{':
+            self._problem(len(head) - len(stripped), 'top level value is not a JSON object')
+            return False
+        return True
+
+    def _skip_container(self, start: int) -> int:
+        # returns the offset just past the container opened at start, or
+        # None if its brackets do not match
+        closing = []
+        for match in _STRUCTURE.finditer(self._buffer, start):
+            first = match.group()[0]
+            if first == ord('"'):
+                continue
+            if first == ord('{') or first == ord('['):
+                closing.append(ord('}') if first == ord('{') else ord(']'))
+            elif len(closing) == 0 or closing.pop() != first:
+                self._problem(match.start(), f'unexpected {chr(first)}')
+                return None
+            if len(closing) == 0:
+                return match.end()
+
+        self._problem(len(self._buffer), 'file ends before the JSON document is complete')
+        return None
+
+    def scan(self) -> None:
+        if not self._check_head():
+            return
+
+        # each entry is [container type, path to it, pending key]
+        stack = []
+        expecting_key = False
+        expecting_colon = False
+        # a value was just completed, only a ',' or a closing bracket may follow
+        expecting_separator = False
+        after_comma = False
+        remaining = len(self._sections)
+        position = 0
+
+        while True:
+            match = _TOKEN.search(self._buffer, position)
+            if match == None:
+                break
+            position = match.end()
+            token = match.group()
+            offset = match.start()
+            first = token[0]
+
+            if first == ord(':'):
+                if not expecting_colon:
+                    self._problem(offset, 'unexpected :')
+                    return
+                expecting_colon = False
+                continue
+            if expecting_colon:
+                self._problem(offset, "expected ':'")
+                return
+
+            if first == ord(','):
+                if not expecting_separator:
+                    self._problem(offset, 'unexpected ,')
+                    return
+                expecting_separator = False
+                after_comma = True
+                expecting_key = stack[-1][0] == 'object'
+                continue
+            if expecting_separator and first != ord('}') and first != ord(']'):
+                self._problem(offset, "expected ','")
+                return
+            expecting_separator = False
+
+            if len(stack) != 0 and stack[-1][0] == 'object' and expecting_key:
+                if first == ord('}') and not after_comma:
+                    pass
+                elif first != ord('"'):
+                    self._problem(offset, 'expected an object key')
+                    return
+                else:
+                    stack[-1][2] = token[1:-1].decode('utf-8', 'replace')
+                    expecting_key = False
+                    expecting_colon = True
+                    after_comma = False
+                    continue
+
+            if first == ord('}') or first == ord(']'):
+                expected = 'object' if first == ord('}') else 'array'
+                if after_comma or len(stack) == 0 or stack[-1][0] != expected:
+                    self._problem(offset, f'unexpected {chr(first)}')
+                    return
+                stack.pop()
+                expecting_key = False
+                expecting_separator = True
+                if len(stack) == 0:
+                    self.completed = True
+                    trailing = self._buffer[match.end():].strip()
+                    if len(trailing) != 0:
+                        self._problem(match.end(), 'unexpected data after the top level object')
+                    return
+                continue
+
+            # a value: work out the key path it sits at, if it is tracked
+            if len(stack) == 0:
+                path = ()
+            elif stack[-1][0] == 'object' and stack[-1][1] != None and len(stack) <= self._max_depth:
+                path = stack[-1][1] + (stack[-1][2],)
+            else:
+                path = None
+            after_comma = False
+            if path != None and first == ord('{'):
+                self.offsets[path] = offset
+
+            if path in self._sections and path not in self.found:
+                actual = _value_type(token)
+                self.found[path] = actual
+                remaining -= 1
+                if self._sections[path] != None and actual != self._sections[path]:
+                    self._problem(offset, f'{_format_path(path)} should be an {self._sections[path]}, found {actual}')
+
+                if self._want_spans:
+                    end = match.end()
+                    if first == ord('{') or first == ord('['):
+                        end = self._skip_container(offset)
+                        if end == None:
+                            return
+                        position = end
+                    self.spans[path] = (offset, end)
+
+                    if remaining == 0:
+                        self.completed = True
+                        return
+                    if first == ord('{') or first == ord('['):
+                        expecting_separator = True
+                        continue
+
+            if (first == ord('{') or first == ord('[')) and path == None:
+                # nothing required lives below here, jump to its end
+                position = self._skip_container(offset)
+                if position == None:
+                    return
+                expecting_separator = True
+            elif first == ord('{'):
+                stack.append(['object', path, None])
+                expecting_key = True
+            elif first == ord('['):
+                stack.append(['array', path, None])
+            elif len(stack) == 0:
+                self._problem(offset, 'top level value is not a JSON object')
+                return
+            else:
+                expecting_separator = True
+
+            if remaining == 0:
+                self.completed = True
+                return
+
+        if len(stack) != 0:
+            self._problem(len(self._buffer), 'file ends before the JSON document is complete')
+
+    def report_missing(self) -> None:
+        # a section can only be missing if the scan got to the end and its
+        # parent exists with the right type. it is reported at the offset
+        # where the parent object starts
+        if not self.completed:
+            return
+
+        for path in self._sections:
+            parent = path[:-1]
+            if path not in self.found and (parent == () or self.found.get(parent) == 'object'):
+                self._problem(self.offsets.get(parent), f'missing {_format_path(path)}')
+
+def validate_buffer(buffer: bytes, sections: dict = REQUIRED_SECTIONS) -> list[StructureProblem]:
+    scanner = _Scanner(buffer, sections)
+    scanner.scan()
+    scanner.report_missing()
+    return scanner.problems
+
+def locate_sections(buffer: bytes, paths: list[tuple]) -> dict:
+    # maps each path found to the (start, end) byte range of its value.
+    # paths inside another requested path are not looked into
+    scanner = _Scanner(buffer, dict.fromkeys(paths), want_spans = True)
+    scanner.scan()
+    return scanner.spans
+
+def validate_save(path: 'File path', sections: dict = REQUIRED_SECTIONS) -> list[StructureProblem]:
+    # an empty list means the file looks like a save and is worth a full load
+    with open(path, 'rb') as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return validate_buffer(b'', sections)
+
+        try:
+            if file_handling.detect_compression(buffer[:4]) != None:
+                try:
+                    return validate_buffer(file_handling.decompress(buffer[:]), sections)
+                except file_handling.CompressionUnavailableError as error:
+                    return [StructureProblem(0, str(error))]
+                except Exception:
+                    return [StructureProblem(0, 'compressed data is corrupt')]
+            return validate_buffer(buffer, sections)
+        finally:
+            buffer.close()
+
+def is_save_file(path: 'File path') -> bool:
+    return len(validate_save(path)) == 0
@@ -0,0 +1,127 @@
+# save_view.py
+#
+# read-only access to a save for inspection. the file is memory-mapped and
+# only the sections that are asked for are located and parsed, and reference
+# data is only read when a lookup needs it (epithets for the profile,
+# adventurers for roster names).
+
+import argparse
+import json
+import mmap
+import dragalia_save_editor_interface
+import file_handling
+import json_handling
+import save_validation
+
+_SECTIONS = {
+    'user_data': (('data', 'user_data'), json_handling.UserDataNotFoundError),
+    'chara_list': (('data', 'chara_list'), json_handling.CharactersNotFoundError),
+    'unit_story_list': (('data', 'unit_story_list'), json_handling.UnitStoryListNotFoundError),
+    'chara_bonus_by_album': (('data', 'fort_bonus_list', 'chara_bonus_by_album'),
+                             json_handling.EncyclopediaBonusesNotFoundError),
+    'dragon_bonus_by_album': (('data', 'fort_bonus_list', 'dragon_bonus_by_album'),
+                              json_handling.EncyclopediaBonusesNotFoundError)}
+
+_shared_reference_data = None
+
+def _get_shared_reference_data() -> json_handling.ReferenceData:
+    global _shared_reference_data
+    if _shared_reference_data == None:
+        _shared_reference_data = json_handling.ReferenceData(lazy = True)
+    return _shared_reference_data
+
+class SaveView:
+    def __init__(self, file_path: 'File path',
+                 reference_data: json_handling.ReferenceData = None):
+        self._file_path = file_path
+        self._reference_data = reference_data or _get_shared_reference_data()
+        self._sections = dict()
+        self._file = open(file_path, 'rb')
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise json_handling.FileConversionError
+
+        # compressed saves cannot be read in place, they are unpacked once
+        if file_handling.detect_compression(self._buffer[:4]) != None:
+            mapped = self._buffer
+            try:
+                self._buffer = file_handling.decompress(mapped[:])
+            except file_handling.CompressionUnavailableError:
+                raise
+            except Exception:
+                raise json_handling.FileConversionError
+            finally:
+                mapped.close()
+                self._file.close()
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
+
+    def __enter__(self) -> 'SaveView':
+        return self
+
+    def __exit__(self, *exc_info) -> bool:
+        self.close()
+        return False
+
+    def _section(self, name: str) -> object:
+        if name not in self._sections:
+            path, error = _SECTIONS[name]
+            spans = save_validation.locate_sections(self._buffer, [path])
+            if path not in spans:
+                raise error
+
+            start, end = spans[path]
+            try:
+                self._sections[name] = json.loads(self._buffer[start:end])
+            except ValueError:
+                raise json_handling.FileConversionError
+        return self._sections[name]
+
+    def get_user_data(self) -> dict:
+        return self._section('user_data').copy()
+
+    def get_character_data(self) -> list:
+        return self._section('chara_list')[:]
+
+    def get_stories(self) -> list:
+        return self._section('unit_story_list')[:]
+
+    def get_encyclo_bonuses(self) -> tuple[list, list]:
+        return (self._section('chara_bonus_by_album')[:],
+                self._section('dragon_bonus_by_album')[:])
+
+    def character_count(self) -> int:
+        return len(self._section('chara_list'))
+
+    def get_profile(self) -> list[str]:
+        return dragalia_save_editor_interface.format_profile(self._section('user_data'),
+                                                             self._reference_data.epithet_data)
+
+    def get_roster(self) -> list[dict]:
+        characters = dragalia_save_editor_interface.sort_characters(self._section('chara_list'))
+        all_character_data = self._reference_data.all_character_data
+        return [dragalia_save_editor_interface.summarize_character(char, all_character_data)
+                for char in characters]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Inspect a save without loading it for editing.')
+    parser.add_argument('save')
+    parser.add_argument('--roster', action = 'store_true', help = 'list owned characters')
+    parser.add_argument('--count', action = 'store_true', help = 'print only the character count')
+    args = parser.parse_args()
+
+    with SaveView(args.save) as view:
+        if args.count:
+            print(view.character_count())
+        elif args.roster:
+            for summary in view.get_roster():
+                print(f"{summary['name']} ({summary['rarity']}* {summary['element']}/{summary['weapon']}) \
+Level {summary['level']} | {summary['mana_circle']} MC | +{summary['augments']}")
+        else:
+            for line in view.get_profile():
+                print(line)